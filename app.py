@@ -1,12 +1,16 @@
-import datetime
+import time
+_import_start = time.perf_counter()
 import logging
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.cron import CronTrigger
+import threading
 import uvicorn
 import uvicorn.config
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
+from fastapi.responses import PlainTextResponse
 from controllers.subscribe import live_router, test_router
-from controllers.cronjobs import *
+from utils.catalog import get_catalog
+import utils.metrics as metrics
+from utils.nlp import warm_pool
+from utils.postgres import engine
 import env
 
 
@@ -17,21 +21,45 @@ if env.ENV_NAME == 'local':
 
 
 logger = logging.getLogger('uvicorn')
+readiness = {'ready': False, 'timings': {'import': round(time.perf_counter() - _import_start, 3)}}
 
 
-# set up background tasks
-scheduler = BackgroundScheduler()
-fetch_job = scheduler.add_job(fetch_parks_json, CronTrigger.from_crontab('0 0 * * MON'))
-update_job = scheduler.add_job(update_wait_times, CronTrigger.from_crontab('1/5 * * * *'))
-close_job = scheduler.add_job(close_out_alerts, CronTrigger.from_crontab('0/5 * * * *'))
-
-
-# define startup tasks
+# define startup tasks - heavy lifting happens off the boot path so the dyno accepts requests right away
+# cron jobs run in worker.py, so any number of web workers can serve webhooks
 @app.on_event('startup')
 def startup():
-    scheduler.modify_job(fetch_job.id, next_run_time=datetime.datetime.now())
-    scheduler.modify_job(update_job.id, next_run_time=datetime.datetime.now() + datetime.timedelta(seconds=10))
-    scheduler.start()
+    threading.Thread(target=warmup, name='warmup', daemon=True).start()
+
+
+# schema is owned by worker.py, web workers only open their first pooled connection
+def connect_db():
+    engine.connect().close()
+
+
+def warmup():
+    try:
+        for stage, step in [('database', connect_db), ('nlp', warm_pool), ('catalog', get_catalog)]:
+            start = time.perf_counter()
+            step()
+            readiness['timings'][stage] = round(time.perf_counter() - start, 3)
+    except Exception:
+        logger.exception('Warmup failed, app will stay unready')
+        return
+    readiness['ready'] = True
+    logger.info(f"Warmup complete, stage timings (seconds): {readiness['timings']}")
+
+
+@app.get('/ready')
+def ready(response:Response):
+    if not readiness['ready']:
+        response.status_code = 503
+    return readiness
+
+
+# per-process, so with several web workers each scrape sees whichever one answered - the worker logs its own per job
+@app.get('/metrics')
+def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4')
 
 
 if __name__ == '__main__':
@@ -41,4 +69,4 @@ if __name__ == '__main__':
             'app:app',
             host='localhost',
             port=5000,
-        )
\ No newline at end of file
+        )
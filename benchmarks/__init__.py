@@ -0,0 +1,12 @@
+import os
+
+# benchmarks run offline, so fill in whatever env.py needs that the shell doesn't provide
+os.environ.setdefault('ENV_NAME', 'bench')
+os.environ.setdefault('LOG_LEVEL', 'warning')
+os.environ.setdefault('MAX_THREADS', '8')
+os.environ.setdefault('DATABASE_URL', 'postgresql://localhost/firewatch_bench')
+# never text real numbers, and don't throttle the stub to twilio's rate
+os.environ.setdefault('SMS_TRANSPORT', 'stub')
+os.environ.setdefault('SMS_RATE', '1000000')
+# benchmarks.suite serves its fake queue-times here, so the cron jobs run unmodified against it
+os.environ.setdefault('QUEUE_TIMES_URL', 'http://127.0.0.1:8765')
@@ -0,0 +1,110 @@
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterable, Iterator, List
+
+
+# local stand-in for queue-times.com, serving synthetic parks.json + queue_times.json files
+class FakeQueueTimes:
+    def __init__(self, num_parks:int=100, rides_per_park:int=50, latency:float=0.05, seed:int=0, park_names:List[str]=None, ride_names:List[List[str]]=None):
+        self.num_parks = num_parks
+        self.rides_per_park = rides_per_park
+        # optional realistic names (see benchmarks.suite), indexed by park id - 1 and ride number
+        self.park_names = park_names
+        self.ride_names = ride_names
+        self.latency = latency # median response delay in seconds, lognormal to give a realistic tail
+        self.random = random.Random(seed)
+        self.seed = seed
+        self.versions = {} # park id -> data version, see publish()
+        self.requests = 0
+
+    def parks_json(self) -> list:
+        return [{
+            'id': 1,
+            'name': 'Synthetic Parks Co',
+            'parks': [
+                {'id': p, 'name': self.park_name(p), 'country': 'United States', 'timezone': 'America/New_York'}
+                for p in range(1, self.num_parks + 1)
+            ],
+        }]
+
+    def queue_times_json(self, park_id:int) -> dict:
+        # deterministic per (park, version) so unchanged parks serve identical bytes
+        rng = random.Random(f"{self.seed}-{park_id}-{self.versions.get(park_id, 0)}")
+        rides = [{
+            'id': park_id * 1000 + r,
+            'name': self.ride_name(park_id, r),
+            'is_open': rng.random() > 0.1,
+            'wait_time': rng.randrange(0, 120, 5),
+        } for r in range(self.rides_per_park)]
+        return {'lands': [{'id': park_id, 'name': 'Main Street', 'rides': rides}], 'rides': []}
+
+    def park_name(self, park_id:int) -> str:
+        return self.park_names[park_id - 1] if self.park_names else f"Synthetic Park {park_id}"
+
+    def ride_name(self, park_id:int, r:int) -> str:
+        return self.ride_names[park_id - 1][r] if self.ride_names else f"Synthetic Ride {park_id}-{r}"
+
+    # make the given parks serve new wait times on their next request
+    def publish(self, park_ids:Iterable[int]):
+        for park_id in park_ids:
+            self.versions[park_id] = self.versions.get(park_id, 0) + 1
+
+    def delay(self) -> float:
+        if self.latency <= 0:
+            return 0
+        return self.random.lognormvariate(0, 0.75) * self.latency
+
+
+def _handler_for(fake:FakeQueueTimes):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1' # keep-alive, so pooled clients can reuse connections
+
+        def do_GET(self):
+            fake.requests += 1
+            time.sleep(fake.delay())
+            match = re.fullmatch(r'/parks/(\d+)/queue_times.json', self.path)
+            if self.path == '/parks.json':
+                body = fake.parks_json()
+            elif match and 0 < int(match.group(1)) <= fake.num_parks:
+                body = fake.queue_times_json(int(match.group(1)))
+            else:
+                self.send_error(404)
+                return
+            content = json.dumps(body).encode()
+            etag = f'"{hashlib.md5(content).hexdigest()}"'
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+@contextmanager
+def serve(fake:FakeQueueTimes, port:int=0) -> Iterator[str]:
+    server = ThreadingHTTPServer(('127.0.0.1', port), _handler_for(fake))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
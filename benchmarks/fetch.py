@@ -0,0 +1,65 @@
+import argparse
+import asyncio
+import statistics
+import time
+from threading import Thread
+import requests
+from benchmarks.fake_queue_times import FakeQueueTimes, serve
+from utils.queuetimes import fetch_wait_times, cache_stats
+
+
+# usage: python -m benchmarks.fetch --parks 200 --concurrency 8 --latency 0.05 [--legacy] [--cycles 3]
+# later cycles only change the data for --volatility of the parks, exercising conditional requests
+
+
+def run_async(base_url:str, park_ids:list, concurrency:int) -> list:
+    results = asyncio.run(fetch_wait_times(park_ids, handler=lambda park_id, j: None, concurrency=concurrency, base_url=base_url))
+    return [r.elapsed for r in results]
+
+
+# the old stop-and-wait thread batches, one fresh connection per request
+def run_legacy(base_url:str, park_ids:list, concurrency:int) -> list:
+    elapsed = []
+    def target(park_id:int):
+        start = time.perf_counter()
+        requests.get(f"{base_url}/parks/{park_id}/queue_times.json").json()
+        elapsed.append(time.perf_counter() - start)
+    for i in range(0, len(park_ids), concurrency):
+        threads = [Thread(target=target, args=(p,)) for p in park_ids[i:i+concurrency]]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--parks', type=int, default=200)
+    parser.add_argument('--rides', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--legacy', action='store_true')
+    parser.add_argument('--cycles', type=int, default=1)
+    parser.add_argument('--volatility', type=float, default=0.2)
+    args = parser.parse_args()
+
+    fake = FakeQueueTimes(num_parks=args.parks, rides_per_park=args.rides, latency=args.latency)
+    park_ids = list(range(1, args.parks + 1))
+    with serve(fake) as base_url:
+        for cycle in range(args.cycles):
+            if cycle > 0:
+                # only a --volatility share of parks publish new data this cycle
+                fake.publish(fake.random.sample(park_ids, int(len(park_ids) * args.volatility)))
+            start = time.perf_counter()
+            elapsed = (run_legacy if args.legacy else run_async)(base_url, park_ids, args.concurrency)
+            total = time.perf_counter() - start
+            quantiles = statistics.quantiles(elapsed, n=100)
+            print(f"cycle {cycle} {'legacy threads' if args.legacy else 'async pipeline'}: {len(elapsed)} parks in {total:.2f}s "
+                  f"({len(elapsed)/total:.1f} parks/s), p50 {quantiles[49]*1000:.0f}ms, p99 {quantiles[98]*1000:.0f}ms")
+    if not args.legacy:
+        print(f"fetch cache stats: {cache_stats()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+import argparse
+import random
+import statistics
+import time
+from typing import List
+from utils.matching import NameIndex
+
+# the pre-index implementation used fuzzywuzzy; fall back to rapidfuzz's equivalent if it isn't installed
+# (rapidfuzz doesn't lowercase or strip punctuation unless asked, fuzzywuzzy's extractOne always does)
+try:
+    from fuzzywuzzy import process as fuzzymatching
+    PROCESSOR = {}
+except ImportError:
+    from rapidfuzz import process as fuzzymatching
+    from rapidfuzz.utils import default_process
+    PROCESSOR = {'processor': default_process}
+
+
+# usage: python -m benchmarks.name_matching --parks 100 --rides 60 --messages 2000
+# chunks are word n-grams of each message, standing in for spaCy noun chunks so only matching is timed
+
+
+ADJECTIVES = ['Big', 'Thunder', 'Space', 'Wild', 'Flying', 'Lost', 'Mystic', 'Iron', 'Twisted', 'Haunted', 'Rapid', 'Golden', 'Frozen', 'Runaway', 'Magic', 'Crazy']
+NOUNS = ['Mountain', 'Coaster', 'Falls', 'River', 'Express', 'Mansion', 'Tower', 'Dragon', 'Mine Train', 'Rapids', 'Carousel', 'Voyage', 'Eagle', 'Cyclone', 'Kingdom', 'Adventure']
+PARK_WORDS = ['Land', 'World', 'Gardens', 'Kingdom', 'Studios', 'Adventures', 'Point', 'Flags', 'Wood', 'Harbor']
+TEMPLATES = [
+    "watch {ride} at {park} for under {wait} minutes",
+    "let me know when {ride} is below {wait} at {park}",
+    "{park} {ride} {wait}",
+    "cancel my alert for {ride} at {park}",
+    "change {ride} at {park} to {wait} minutes please",
+]
+
+
+def synthetic_names(rng:random.Random, count:int, words:List[List[str]]) -> List[str]:
+    names = set()
+    while len(names) < count:
+        names.add(' '.join(rng.choice(w) for w in words) + ('' if rng.random() < 0.7 else f" {rng.randint(2, 9)}"))
+    return sorted(names)
+
+
+def chunks(msg:str) -> List[str]:
+    words = msg.split()
+    return [' '.join(words[i:i+n]) for n in (2, 3) for i in range(len(words) - n + 1)]
+
+
+def legacy_match(queries:List[str], names:List[str], threshold:int):
+    closest_match, best_ratio = None, 0
+    for query in queries:
+        match, ratio = fuzzymatching.extractOne(query, names, **PROCESSOR)[:2]
+        if ratio > best_ratio:
+            closest_match, best_ratio = match, ratio
+            if ratio == 100:
+                break
+    if best_ratio > threshold:
+        return names.index(closest_match)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--parks', type=int, default=100)
+    parser.add_argument('--rides', type=int, default=60)
+    parser.add_argument('--messages', type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    parks = synthetic_names(rng, args.parks, [ADJECTIVES, PARK_WORDS])
+    rides = {p:synthetic_names(rng, args.rides, [ADJECTIVES, NOUNS]) for p in parks}
+    messages = []
+    for _ in range(args.messages):
+        park = rng.choice(parks)
+        ride = rng.choice(rides[park])
+        msg = rng.choice(TEMPLATES).format(ride=ride.lower() if rng.random() < 0.5 else ride, park=park, wait=rng.randrange(5, 60, 5))
+        messages.append((park, msg))
+
+    build = time.perf_counter()
+    park_index = NameIndex(parks)
+    ride_indexes = {p:NameIndex(rides[p]) for p in parks}
+    build = time.perf_counter() - build
+
+    timings = {'legacy': [], 'index': []}
+    agree = 0
+    for park, msg in messages:
+        queries = chunks(msg)
+        start = time.perf_counter()
+        legacy = (legacy_match(queries, parks, 30), legacy_match(queries, rides[park], 70))
+        timings['legacy'].append(time.perf_counter() - start)
+        start = time.perf_counter()
+        indexed = (park_index.match(queries, 30), ride_indexes[park].match(queries, 70))
+        timings['index'].append(time.perf_counter() - start)
+        agree += legacy == tuple(None if m is None else m[0] for m in indexed)
+
+    print(f"index build for {args.parks} parks x {args.rides} rides: {build*1000:.1f}ms")
+    for name, elapsed in timings.items():
+        quantiles = statistics.quantiles(elapsed, n=100)
+        print(f"{name}: p50 {quantiles[49]*1e6:.0f}us, p99 {quantiles[98]*1e6:.0f}us, total {sum(elapsed):.2f}s")
+    print(f"same park + ride as legacy for {agree}/{len(messages)} messages")
+
+
+if __name__ == '__main__':
+    main()
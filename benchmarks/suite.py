@@ -0,0 +1,207 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+from typing import Callable, Dict, List
+from urllib.parse import urlparse
+from sqlalchemy import insert, text
+from benchmarks.fake_queue_times import FakeQueueTimes, serve
+from benchmarks.name_matching import ADJECTIVES, NOUNS, PARK_WORDS, TEMPLATES, synthetic_names
+import controllers.cronjobs as cronjobs
+import utils.catalog as catalog
+import utils.nlp as nlp
+from utils.polling import PollScheduler
+from utils.postgres import engine, init_db, Alert, Base
+import utils.sms as sms
+import env
+
+
+# usage: python -m benchmarks.suite [--save] [--parks 400 --rides 50 --alerts 100000 --messages 500]
+# end-to-end run of the real jobs + message handler against a local postgres (DATABASE_URL, must be a *bench*
+# database - it gets wiped), the fake queue-times server and the stub sms transport
+# without --save, results are compared against the stored baseline - a missing baseline or any regression exits non-zero
+
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baselines.json')
+
+
+def summarize(samples:List[float], throughput:float, unit:str) -> dict:
+    if len(samples) < 2:
+        # statistics.quantiles needs two points, a single (or no) sample is its own p50 + p99
+        quantiles = (samples or [0.0]) * 99
+    else:
+        quantiles = statistics.quantiles(samples, n=100)
+    return {'throughput': round(throughput, 2), 'unit': unit, 'p50': round(quantiles[49], 4), 'p99': round(quantiles[98], 4), 'samples': len(samples)}
+
+
+def reset_database():
+    if 'bench' not in (engine.url.database or ''):
+        sys.exit(f"Refusing to wipe '{engine.url.database}', point DATABASE_URL at a database with 'bench' in its name")
+    Base.metadata.drop_all(bind=engine)
+    init_db()
+
+
+def seed_alerts(count:int, rng:random.Random):
+    with engine.begin() as connection:
+        rides = connection.execute(text('SELECT id, park_id FROM rides')).all()
+        expiration = int(time.time()) + 86400
+        rows = [{
+            'id': str(uuid.uuid4()),
+            'ride_id': ride_id,
+            'park_id': park_id,
+            'phone_number': f"+1555{rng.randrange(10**7):07d}",
+            'wait_time': rng.randrange(5, 60, 5),
+            'expiration': expiration,
+        } for ride_id, park_id in (rng.choice(rides) for _ in range(count))]
+        for i in range(0, len(rows), 10000):
+            connection.execute(insert(Alert), rows[i:i+10000])
+
+
+# cron cycles where --volatility of the parks publish new waits, timing each changed park's write + alert close-out
+def bench_ingestion(fake:FakeQueueTimes, cycles:int, volatility:float) -> dict:
+    park_ids = list(range(1, fake.num_parks + 1))
+    writes = []
+    write = cronjobs._write_wait_times
+    def timed_write(*args, **kwargs):
+        start = time.perf_counter()
+        write(*args, **kwargs)
+        writes.append(time.perf_counter() - start)
+    cronjobs._write_wait_times = timed_write
+    try:
+        total = 0.0
+        for _ in range(cycles):
+            fake.publish(fake.random.sample(park_ids, int(len(park_ids) * volatility)))
+            # cycles run back to back, so make every park due - otherwise the adaptive scheduler polls next to none
+            cronjobs.poll_scheduler = PollScheduler()
+            start = time.perf_counter()
+            cronjobs.update_wait_times()
+            total += time.perf_counter() - start
+    finally:
+        cronjobs._write_wait_times = write
+    return summarize(writes, len(writes) / total, 'parks/s')
+
+
+# rounds of expiring a slice of the alerts and closing them out
+def bench_close_out(rounds:int, batch:int) -> dict:
+    durations, closed = [], 0
+    for _ in range(rounds):
+        with engine.begin() as connection:
+            closed += connection.execute(
+                text('UPDATE alerts SET expiration = 0 WHERE id IN (SELECT id FROM alerts WHERE expiration > 0 LIMIT :batch)'),
+                {'batch': batch},
+            ).rowcount
+        start = time.perf_counter()
+        cronjobs.close_out_alerts()
+        durations.append(time.perf_counter() - start)
+    return summarize(durations, closed / sum(durations), 'alerts/s')
+
+
+async def _handle_messages(messages:List[str], concurrency:int) -> List[float]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    async def one(i:int, msg:str):
+        async with semaphore:
+            start = time.perf_counter()
+            await sms.process_message(msg, f"+1555{i % 10**7:07d}")
+            latencies.append(time.perf_counter() - start)
+    await asyncio.gather(*[one(i, msg) for i, msg in enumerate(messages)])
+    return latencies
+
+
+def bench_webhook(messages:List[str], concurrency:int) -> dict:
+    start = time.perf_counter()
+    latencies = asyncio.run(_handle_messages(messages, concurrency))
+    return summarize(latencies, len(latencies) / (time.perf_counter() - start), 'messages/s')
+
+
+# latencies may grow and throughput may drop by at most the tolerance
+def regressions(results:Dict[str, dict], baseline:Dict[str, dict], tolerance:float) -> List[str]:
+    failures = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for key in ('p50', 'p99'):
+            if result[key] > base[key] * (1 + tolerance):
+                failures.append(f"{name} {key} {result[key]*1000:.1f}ms vs baseline {base[key]*1000:.1f}ms")
+        if result['throughput'] < base['throughput'] * (1 - tolerance):
+            failures.append(f"{name} throughput {result['throughput']} vs baseline {base['throughput']} {result['unit']}")
+    return failures
+
+
+def timed(label:str, step:Callable, *args):
+    start = time.perf_counter()
+    result = step(*args)
+    print(f"{label} in {time.perf_counter() - start:.1f}s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--parks', type=int, default=400)
+    parser.add_argument('--rides', type=int, default=50)
+    parser.add_argument('--alerts', type=int, default=100000)
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--cycles', type=int, default=5)
+    parser.add_argument('--volatility', type=float, default=0.3)
+    parser.add_argument('--closeout-rounds', type=int, default=10)
+    parser.add_argument('--closeout-batch', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save', action='store_true')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    park_names = synthetic_names(rng, args.parks, [ADJECTIVES, PARK_WORDS])
+    ride_names = [synthetic_names(rng, args.rides, [ADJECTIVES, NOUNS]) for _ in park_names]
+    fake = FakeQueueTimes(args.parks, args.rides, args.latency, park_names=park_names, ride_names=ride_names)
+    messages = []
+    for _ in range(args.messages):
+        p = rng.randrange(args.parks)
+        messages.append(rng.choice(TEMPLATES).format(park=park_names[p], ride=rng.choice(ride_names[p]), wait=rng.randrange(5, 60, 5)))
+
+    with serve(fake, port=urlparse(env.QUEUE_TIMES_URL).port):
+        # setup, untimed: schema, catalog, first full ingestion, alerts, nlp workers
+        timed('reset database', reset_database)
+        timed('synced parks', cronjobs.fetch_parks_json)
+        timed('initial ingestion', cronjobs.update_wait_times)
+        timed(f"seeded {args.alerts} alerts", seed_alerts, args.alerts, rng)
+        timed('warmed nlp', nlp.warm_pool)
+        catalog.invalidate()
+
+        results = {
+            'ingestion': bench_ingestion(fake, args.cycles, args.volatility),
+            'close_out': bench_close_out(args.closeout_rounds, args.closeout_batch),
+            'webhook': bench_webhook(messages, args.concurrency),
+        }
+    print(f"stub transport recorded {len(sms.get_outbox().transport.sent)} messages")
+    for name, result in results.items():
+        print(f"{name}: {result['throughput']} {result['unit']}, p50 {result['p50']*1000:.1f}ms, p99 {result['p99']*1000:.1f}ms ({result['samples']} samples)")
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"baseline saved to {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print(f"no baseline at {args.baseline}, run with --save to record one")
+        sys.exit(1)
+    with open(args.baseline) as f:
+        failures = regressions(results, json.load(f), args.tolerance)
+    if len(failures) > 0:
+        print(f"REGRESSION (tolerance {args.tolerance:.0%}):")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+    print(f"within {args.tolerance:.0%} of baseline")
+
+
+if __name__ == '__main__':
+    main()
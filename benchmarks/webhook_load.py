@@ -0,0 +1,52 @@
+import argparse
+import asyncio
+import random
+import statistics
+import time
+import httpx
+
+
+# usage: python -m benchmarks.webhook_load --url http://localhost:5000/test/twilio --concurrency 32 --requests 500
+# point it at a local app (ENV_NAME=local mounts the unvalidated test router) and run it once per revision to compare
+
+
+MESSAGES = [
+    "watch space mountain at magic kingdom for under 20 minutes",
+    "let me know when the beast at kings island is below 30",
+    "dollywood lightning rod 15",
+    "cancel my alert for millennium force at cedar point",
+    "change steel vengeance at cedar point to 25 minutes please",
+]
+
+
+async def run(url:str, concurrency:int, total:int) -> list:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    async with httpx.AsyncClient(timeout=60, limits=httpx.Limits(max_connections=concurrency)) as client:
+        async def one(i:int):
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post(url, data={'Body': random.choice(MESSAGES), 'From': f"+1555{i % 10000:07d}"})
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+        await asyncio.gather(*[one(i) for i in range(total)])
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='http://localhost:5000/test/twilio')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=500)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    latencies = asyncio.run(run(args.url, args.concurrency, args.requests))
+    total = time.perf_counter() - start
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(f"{len(latencies)} requests at concurrency {args.concurrency} in {total:.2f}s ({len(latencies)/total:.1f} req/s), "
+          f"p50 {quantiles[49]*1000:.0f}ms, p99 {quantiles[98]*1000:.0f}ms")
+
+
+if __name__ == '__main__':
+    main()
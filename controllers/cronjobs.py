@@ -1,107 +1,181 @@
+import asyncio
+from contextlib import contextmanager
+import datetime
+import functools
+import hashlib
 import logging
-from threading import Thread
 import time
+from typing import List
 import requests
-from utils.postgres import Park, CrudUtils
-from utils.sms import send_alert_sms
+from utils.alerts import AlertIndex
+import utils.history as history
+import utils.metrics as metrics
+from utils.polling import PollScheduler
+from utils.postgres import ClosedAlert, CrudUtils, count_queries
+from utils.queuetimes import fetch_wait_times, cache_stats
+from utils.sms import send_alert_sms, FAILED, REJECTED
 import env
 
 
 logger = logging.getLogger('uvicorn')
 
 
-# cronjob task for pulling new parks data
+PARKS_MAX_REMOVED_SHARE = 0.2 # a parks.json dropping more of the stored parks than this is treated as bad data...
+PARKS_CONFIRM_RUNS = 3 # ...until the same file has been served on this many runs in a row, then the removal goes through
+# conditional request state for parks.json, kept for the life of the worker
+_parks_headers = {}
+_parks_state = {}
+poll_scheduler = PollScheduler()
+
+
+# per-run duration, statement count + db time, and a breakdown of every stage metric the job touched
+@contextmanager
+def _instrumented(job:str):
+    with metrics.delta() as stages, count_queries() as queries, metrics.JOB_SECONDS.time(job=job):
+        yield
+    metrics.JOB_STATEMENTS.observe(queries.count, job=job)
+    metrics.JOB_DB_SECONDS.observe(queries.elapsed, job=job)
+    logger.info(f"job={job} statements={queries.count} db_seconds={queries.elapsed:.3f} {metrics.format_delta(stages)}")
+
+
+# cronjob task for pulling new parks data - cheap enough to run hourly, unchanged files stop at the conditional request
+@_instrumented('fetch_parks_json')
 def fetch_parks_json():
     logger.info('Fetching latest parks.json file...')
     start = time.time()
     # get latest parks.json
     filepath = 'parks.json'
-    response = requests.get(f"https://queue-times.com/en-US/{filepath}")
+    response = requests.get(f"{env.QUEUE_TIMES_URL}/{filepath}", headers=_parks_headers, timeout=30)
+    if response.status_code == 304:
+        logger.info('parks.json not modified since last sync')
+        return
+    response.raise_for_status()
+    digest = hashlib.sha256(response.content).hexdigest()
+    if digest == _parks_state.get('digest'):
+        logger.info('parks.json unchanged since last sync')
+        return
     j = response.json()
     logger.debug('File fetched successfully')
     # parse parks.json
-    existing_park_ids = set([p.id for p in CrudUtils.read_parks()])
-    for company in j:
-        parks = company['parks']
-        for park in parks:
-            id, name, country = park['id'], park['name'], park['country']
-            name=str(name).strip()
-            country=str(country).strip()
-            if country != 'United States':
-                continue
-            if id in existing_park_ids:
-                CrudUtils.update_parks(id=id, updates={'name':name})
-                logger.debug(f"Record updated for {name} ({id})")
-            else:
-                CrudUtils.create_park(id=id, name=name)
-                logger.debug(f"Record created for {name} ({id})")
-    logger.info(f"Fetched parks.json and updated database in {time.time()-start:.1f} seconds")
-
-
-# combined job for fetching wait times + updating in database
+    parks = [
+        {'id': park['id'], 'name': str(park['name']).strip(), 'timezone': park.get('timezone')}
+        for company in j
+        for park in company['parks']
+        if str(park['country']).strip() == 'United States'
+    ]
+    # a glitch doesn't survive hours of identical files, a real drop does - an empty file is never trusted though
+    sightings = _parks_state.get('sightings', 0) + 1 if _parks_state.get('withheld') == digest else 1
+    confirmed = sightings >= PARKS_CONFIRM_RUNS and len(parks) > 0
+    summary = CrudUtils.sync_parks(parks, max_removed_share=1.0 if confirmed else PARKS_MAX_REMOVED_SHARE)
+    if len(summary.withheld) > 0:
+        _parks_state['withheld'], _parks_state['sightings'] = digest, sightings
+        until = 'an empty file is never applied' if len(parks) == 0 else f"until {PARKS_CONFIRM_RUNS - sightings} more runs see the same file"
+        logger.warning(f"parks.json is missing {len(summary.withheld)} stored parks, not removing them ({until}): {summary.withheld}")
+    # a withheld removal means the file looked wrong, so look at it again next time
+    else:
+        _parks_state.pop('withheld', None)
+        _parks_state.pop('sightings', None)
+        _parks_state['digest'] = digest
+        _parks_headers.clear()
+        if response.headers.get('ETag') is not None:
+            _parks_headers['If-None-Match'] = response.headers['ETag']
+    logger.info(
+        f"Synced parks.json in {time.time()-start:.1f} seconds: {len(summary.created)} created {summary.created}, "
+        f"{len(summary.updated)} updated {summary.updated}, {len(summary.removed)} removed {summary.removed}, {summary.unchanged} unchanged"
+    )
+
+
+# combined job for fetching wait times + updating in database + firing alerts on rides whose wait dropped
+# ticks every minute, but only polls the parks whose state makes them due (see utils/polling.py)
+@_instrumented('update_wait_times')
 def update_wait_times():
-    logger.info('Fetching latest wait times json files...')
     start = time.time()
-    all_parks = CrudUtils.read_parks()
-    threads = []
-    for i,park in enumerate(all_parks):
-        logger.debug(f"Processing {park}")
-        threads.append(Thread(
-            target=_update_wait_times_thread_target,
-            kwargs = {'park':park}
-        ))
-        if len(threads) == env.MAX_THREADS or i == len(all_parks) - 1:
-            for th in threads:
-                th.start()
-            for th in threads:
-                th.join()
-            threads = []
+    # a park that just gained an alert is promoted to due straight away
+    watchers = CrudUtils.count_alerts_by_park()
+    park_ids = poll_scheduler.due([p.id for p in CrudUtils.read_parks()], watchers, now=start)
+    if len(park_ids) == 0:
+        logger.debug('No parks due for a wait times refresh')
+        return
+    logger.info(f"Fetching latest wait times json files for {len(park_ids)} parks...")
+    alert_index = AlertIndex.load(park_ids)
+    samples, triggered = [], []
+    handler = functools.partial(_write_wait_times, alert_index=alert_index, samples=samples, triggered=triggered)
+    results = asyncio.run(fetch_wait_times(park_ids, handler=handler))
+    for r in results:
+        poll_scheduler.reschedule(r.park_id, r.ok, r.changed, now=time.time())
+    # one close-out pass for the whole cycle, so a recipient watching several parks gets one message
+    if len(triggered) > 0:
+        closed = CrudUtils.close_alerts(now=int(time.time()), notify=_notify, alert_ids=triggered)
+        logger.info(f"Closed {len(closed)} of {len(triggered)} triggered alerts")
+    # every fresh payload goes into the history store in one COPY
+    try:
+        CrudUtils.copy_ride_waits(samples)
+    except Exception as e:
+        logger.warning(f"Failed to record {len(samples)} wait time samples: {e!r}")
+    failed = [r.park_id for r in results if not r.ok]
+    if len(failed) > 0:
+        logger.warning(f"Wait times not refreshed for parks {failed}")
+    changed = sum(r.changed for r in results)
+    logger.info(f"{changed} of {len(results)} parks changed, cumulative fetch cache stats: {cache_stats()}, poll states: {poll_scheduler.stats()}")
     logger.info(f"Fetched wait times and updated database in {time.time()-start:.1f} seconds")
-# actual worker, defined for threading
-def _update_wait_times_thread_target(park:Park):
-    response = requests.get(f"https://queue-times.com/en-US/parks/{park.id}/queue_times.json")
-    j = response.json()
-    all_ride_ids = set([r.id for r in CrudUtils.read_rides(park_id=park.id)])
-    for land in j['lands']:
-        for ride in land['rides']:
-            # put riderecords in rides table
-            if ride['id'] in all_ride_ids:
-                CrudUtils.update_rides(
-                    id=ride['id'],
-                    updates={'wait_time':ride['wait_time'], 'is_open':ride['is_open']}
-                )
-            else:
-                CrudUtils.create_ride(id=ride['id'], name=str(ride['name']).strip(), park_id=park.id, wait_time=ride['wait_time'], is_open=ride['is_open'])
-
-
-# cronjob task for fulfilling / expiring alerts and notifying users
+# db writer, called as each park's payload arrives
+def _write_wait_times(park_id:int, j:dict, alert_index:AlertIndex, samples:List[tuple], triggered:List[str]):
+    # flatten lands into one payload (keyed by id, one row per ride) and write it in a single statement
+    rides = {ride['id']:ride for land in j['lands'] for ride in land['rides']}
+    with metrics.WRITE_SECONDS.time(), count_queries() as queries:
+        changes = CrudUtils.bulk_upsert_rides(park_id=park_id, rides=list(rides.values()))
+    samples.extend(history.samples(list(rides.values()), ts=int(time.time())))
+    # candidates only - close_alerts re-checks them against the database at the end of the cycle
+    with metrics.ALERT_EVALUATION_SECONDS.time():
+        triggered.extend(alert_index.evaluate(changes))
+    poll_scheduler.observe(park_id, rides=len(rides), changed=len(changes), is_open=any(r['is_open'] for r in rides.values()))
+    logger.debug(f"Upserted {len(changes)} of {len(rides)} rides for park {park_id} in {queries.count} queries")
+
+
+# daily maintenance of the wait time history - partitions ahead, retention, rollups + forecasts
+@_instrumented('roll_up_wait_history')
+def roll_up_wait_history():
+    logger.info('Rolling up wait time history...')
+    start = time.time()
+    today = datetime.datetime.utcnow().date()
+    CrudUtils.create_history_partitions(days=env.HISTORY_PARTITIONS_AHEAD, start=today)
+    dropped = CrudUtils.drop_history_partitions(before=today - datetime.timedelta(days=env.HISTORY_RETENTION_DAYS))
+    counts = history.slot_counts(days=env.HISTORY_RETENTION_DAYS, today=today)
+    rollups = history.compute_rollups(counts)
+    forecasts = history.compute_forecasts(counts)
+    # twilio gives up retrying a webhook within minutes, a day of sids is plenty
+    CrudUtils.prune_inbound_messages(before=int(time.time()) - 86400)
+    logger.info(f"Dropped {len(dropped)} history partitions and computed {rollups} rollups + {forecasts} forecasts in {time.time()-start:.1f} seconds")
+
+
+# cronjob task for closing expired alerts and notifying users
+# update_wait_times closes fulfilled alerts as the waits land; this sweep only adds the ones an earlier pass claimed
+# but didn't finish (sms not acknowledged, worker died mid-send)
+@_instrumented('close_out_alerts')
 def close_out_alerts():
     logger.info("Sending alert notifications...")
     start = time.time()
-    # get all parks
-    parks = CrudUtils.read_parks()
-    for p in parks:
-        logger.debug(f"Fulfilling alerts for {p}")
-        print(f"Fulfilling alerts for {p}")
-        rides = CrudUtils.read_rides(park_id=p.id)
-        rides.sort(key=lambda r:r.id)
-        alerts = CrudUtils.read_alerts(park_id=p.id)
-        alerts.sort(key=lambda a:a.ride_id)
-        # two pointer logic
-        r, a = 0, 0
-        while r < len(rides) and a < len(alerts):
-            if alerts[a].ride_id != rides[r].id:
-                r += 1
-            else:
-                while a < len(alerts) and alerts[a].ride_id == rides[r].id:
-                    # check ride wait time
-                    expired = alerts[a].expiration <= time.time()
-                    if rides[r].wait_time <= alerts[a].wait_time or expired:
-                        # send text message for fulfilled/expired and delete alert
-                        logger.debug(f"Closing out alert {alerts[a]}{' <<EXPIRED>>' if expired else ''}")
-                        print(f"Closing out alert {alerts[a]}{' <<EXPIRED>>' if expired else ''}")
-                        send_alert_sms(alerts[a].phone_number, rides[r].name, alerts[a].wait_time if expired else rides[r].wait_time, expired)
-                        CrudUtils.delete_alerts(id=alerts[a].id)
-                    # move to next ride
-                    a += 1
-    logger.info(f"Alert notifications complete in {time.time()-start:.1f} seconds")
\ No newline at end of file
+    # index lookups on expiration + claimed_until, cost scales with the alerts that actually close
+    closed = CrudUtils.close_alerts(now=int(time.time()), notify=_notify, include_fulfilled=False)
+    logger.info(f"Closed {len(closed)} alerts and sent notifications in {time.time()-start:.1f} seconds")
+
+
+# one combined notification per recipient, all queued at once, then report which alerts are settled
+def _notify(closed:List[ClosedAlert]) -> List[str]:
+    by_recipient = {}
+    for alert in closed:
+        logger.debug(f"Closing out alert {alert}{' <<EXPIRED>>' if alert.expired else ''}")
+        by_recipient.setdefault(alert.phone_number, []).append(alert)
+    futures = {recipient:send_alert_sms(recipient, alerts) for recipient, alerts in by_recipient.items()}
+    logger.info(f"Queued {sum(len(f) for f in futures.values())} messages to {len(by_recipient)} recipients for {len(closed)} alerts")
+    # a recipient's alerts close once every part of their message went out, or twilio refused it for good -
+    # only a temporary failure leaves them for the next pass
+    settled = []
+    for recipient, alerts in by_recipient.items():
+        outcomes = [future.result() for future in futures[recipient]]
+        if FAILED in outcomes:
+            continue
+        if REJECTED in outcomes:
+            logger.warning(f"Dropping {len(alerts)} alerts for {recipient}, their notification was rejected")
+        settled.extend(alert.id for alert in alerts)
+    return settled
@@ -1,6 +1,10 @@
 import logging
+import uuid
 from fastapi import APIRouter, Form, Header, Request, Response
 from twilio.request_validator import RequestValidator
+from utils.postgres import count_queries
+import utils.inbox as inbox
+import utils.metrics as metrics
 import utils.sms as sms
 import env
 
@@ -12,7 +16,7 @@ validator = RequestValidator(env.TWILIO_AUTH_TOKEN)
 
 
 @live_router.post('/twilio')
-async def live_sms_reply(request: Request, From:str = Form(...), Body:str = Form(...)):
+async def live_sms_reply(request: Request, From:str = Form(...), Body:str = Form(...), MessageSid:str = Form(None)):
     # verify request authenticity
     url = f"https://{env.HEROKU_APP_NAME}.herokuapp.com{live_router.prefix}/twilio"
     logger.info(f"App URL: '{url}'")
@@ -21,17 +25,37 @@ async def live_sms_reply(request: Request, From:str = Form(...), Body:str = Form
         logger.warning(f"Invalid requestor blocked: <<{params}>>")
         return Response(status_code=403)
 
+    # ack straight away and reply through the outbound api once the message is handled
+    if env.WEBHOOK_MODE == 'background' and MessageSid is not None:
+        return _enqueue(MessageSid, Body, From, route='live')
+
     # process message
     logger.info(f"Received message: '{Body}'")
-    reply = sms.process_message(Body, From)
-    logger.info(f"Response message: <<{reply}>>")
+    with metrics.WEBHOOK_SECONDS.time(route='live'), count_queries() as queries:
+        reply = await sms.process_message(Body, From)
+    metrics.WEBHOOK_STATEMENTS.observe(queries.count, route='live')
+    logger.info(f"Response message: <<{reply}>> ({queries.count} queries)")
     return sms.create_reply_twiml([reply], status_code=200)
 
 
 # no validation, only mounted into app for local env
 @test_router.post('/twilio')
-async def test_sms_reply(Body:str = Form(...), From:str = Form(...)):
+async def test_sms_reply(Body:str = Form(...), From:str = Form(...), MessageSid:str = Form(None)):
+    if env.WEBHOOK_MODE == 'background':
+        return _enqueue(MessageSid or f"SM{uuid.uuid4().hex}", Body, From, route='test')
     logger.info(f"Received message: '{Body}'")
-    reply = sms.process_message(Body, From)
-    logger.info(f"Response message: <<{reply}>>")
-    return sms.create_reply_twiml([reply], status_code=200)
\ No newline at end of file
+    with metrics.WEBHOOK_SECONDS.time(route='test'), count_queries() as queries:
+        reply = await sms.process_message(Body, From)
+    metrics.WEBHOOK_STATEMENTS.observe(queries.count, route='test')
+    logger.info(f"Response message: <<{reply}>> ({queries.count} queries)")
+    return sms.create_reply_twiml([reply], status_code=200)
+
+
+def _enqueue(sid:str, body:str, phone_number:str, route:str) -> Response:
+    with metrics.WEBHOOK_SECONDS.time(route=route):
+        if inbox.submit(sid, body, phone_number):
+            logger.info(f"Received message {sid}: '{body}'")
+        else:
+            logger.info(f"Dropped duplicate message {sid}")
+        # empty twiml - twilio sends nothing back for this request
+        return sms.create_reply_twiml([], status_code=200)
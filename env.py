@@ -5,8 +5,20 @@ from os import getenv
 ENV_NAME = getenv('ENV_NAME')
 LOG_LEVEL = getenv('LOG_LEVEL').upper()
 MAX_THREADS = int(getenv('MAX_THREADS'))
+QUEUE_TIMES_URL = getenv('QUEUE_TIMES_URL', 'https://queue-times.com/en-US')
 DATABASE_URL = getenv('DATABASE_URL')
+DB_POOL_SIZE = int(getenv('DB_POOL_SIZE', '5')) # per web worker, for the asyncpg engine
+NLP_WORKERS = int(getenv('NLP_WORKERS', '1')) # spaCy processes per web worker, 0 parses on a thread instead
+SPACY_MODEL_PATH = getenv('SPACY_MODEL_PATH') # optional pre-serialized pipeline, see nlp.export_model
+CATALOG_CHECK_INTERVAL = int(getenv('CATALOG_CHECK_INTERVAL', '10')) # seconds between checks that the in-memory park/ride catalog is current
+HISTORY_RETENTION_DAYS = int(getenv('HISTORY_RETENTION_DAYS', '56'))
+HISTORY_PARTITIONS_AHEAD = int(getenv('HISTORY_PARTITIONS_AHEAD', '3'))
 HEROKU_APP_NAME = getenv('HEROKU_APP_NAME') # set by heroku env
 TWILIO_ACCOUNT_SID = getenv('TWILIO_ACCOUNT_SID')
 TWILIO_AUTH_TOKEN = getenv('TWILIO_AUTH_TOKEN')
-TWILIO_PHONE_NUMBER = getenv('TWILIO_PHONE_NUMBER')
\ No newline at end of file
+TWILIO_PHONE_NUMBER = getenv('TWILIO_PHONE_NUMBER')
+SMS_TRANSPORT = getenv('SMS_TRANSPORT', 'twilio') # 'stub' records messages instead of sending them
+SMS_WORKERS = int(getenv('SMS_WORKERS', '4'))
+SMS_RATE = float(getenv('SMS_RATE', '1')) # messages per second, twilio's limit for one long code - shared by every process sending from it
+WEBHOOK_MODE = getenv('WEBHOOK_MODE', 'inline') # 'background' acks twilio right away and replies through the outbound api
+WEBHOOK_WORKERS = int(getenv('WEBHOOK_WORKERS', '8')) # concurrent background messages per web worker, one sender's messages are handled in order
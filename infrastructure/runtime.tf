@@ -20,9 +20,21 @@ resource "heroku_formation" "dyno_type" {
 }
 
 
+resource "heroku_formation" "worker_dyno_type" {
+  app_id   = heroku_app.app.id
+  type     = "worker"
+  size     = "hobby"
+  quantity = 1
+
+  depends_on = [
+    null_resource.deployment_script,
+  ]
+}
+
+
 resource "heroku_addon" "database" {
   app_id = heroku_app.app.id
-  plan   = "heroku-postgresql:hobby-dev"
+  plan   = var.database_plan
 }
 
 
@@ -15,4 +15,10 @@ variable "twilio_auth_token" {
 variable "twilio_phone_number" {
   type      = string
   sensitive = true
-}
\ No newline at end of file
+}
+
+# the wait history outgrows the 10,000 row hobby-dev cap within hours, see "Database Sizing" in docs/index.md
+variable "database_plan" {
+  type    = string
+  default = "heroku-postgresql:essential-1"
+}
@@ -0,0 +1,26 @@
+import os
+import pytest
+
+# fill in whatever env.py needs, against a throwaway database (TEST_DATABASE_URL, wiped by the db fixture)
+os.environ.setdefault('ENV_NAME', 'test')
+os.environ.setdefault('LOG_LEVEL', 'warning')
+os.environ.setdefault('MAX_THREADS', '4')
+os.environ.setdefault('SMS_TRANSPORT', 'stub')
+os.environ.setdefault('SMS_RATE', '1000000')
+os.environ.setdefault('NLP_WORKERS', '0')
+os.environ['DATABASE_URL'] = os.environ.get('TEST_DATABASE_URL', 'postgresql://localhost/firewatch_test')
+
+
+@pytest.fixture
+def db():
+    from sqlalchemy.exc import OperationalError
+    from utils.postgres import engine, init_db, Base
+    if 'test' not in (engine.url.database or ''):
+        pytest.skip(f"refusing to wipe '{engine.url.database}', TEST_DATABASE_URL needs 'test' in its name")
+    try:
+        engine.connect().close()
+    except OperationalError:
+        pytest.skip('no postgres at TEST_DATABASE_URL')
+    Base.metadata.drop_all(bind=engine)
+    init_db()
+    yield engine
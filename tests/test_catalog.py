@@ -0,0 +1,43 @@
+import env
+import utils.catalog as catalog
+from utils.postgres import CrudUtils
+
+
+def ride(id:int, name:str, wait_time:int=5) -> dict:
+    return {'id': id, 'name': name, 'wait_time': wait_time, 'is_open': True}
+
+
+def test_reloads_only_when_the_catalog_version_moves(db, monkeypatch):
+    # check the version on every lookup
+    monkeypatch.setattr(env, 'CATALOG_CHECK_INTERVAL', 0)
+    CrudUtils.sync_parks([{'id': 1, 'name': 'Park 1'}, {'id': 2, 'name': 'Park 2'}])
+    CrudUtils.bulk_upsert_rides(park_id=1, rides=[ride(10, 'Big Coaster')])
+    CrudUtils.bulk_upsert_rides(park_id=2, rides=[ride(20, 'Log Flume')])
+    catalog.invalidate()
+    before = catalog.get_catalog()
+
+    # new waits don't touch any names
+    CrudUtils.bulk_upsert_rides(park_id=1, rides=[ride(10, 'Big Coaster', wait_time=40)])
+    assert catalog.get_catalog() is before
+
+    # a rename reloads, but only the park index is rebuilt
+    CrudUtils.sync_parks([{'id': 1, 'name': 'Park One'}, {'id': 2, 'name': 'Park 2'}])
+    renamed = catalog.get_catalog()
+    assert renamed is not before
+    assert renamed.park_index.names == ['park one', 'park 2']
+    assert renamed.ride_index(1) is before.ride_index(1)
+
+    CrudUtils.bulk_upsert_rides(park_id=1, rides=[ride(11, 'Drop Tower')])
+    added = catalog.get_catalog()
+    assert added.ride_index(1).names == ['big coaster', 'drop tower']
+    assert added.park_index is renamed.park_index
+    assert added.ride_index(2) is before.ride_index(2)
+
+
+def test_checks_the_version_at_most_every_interval(db, monkeypatch):
+    monkeypatch.setattr(env, 'CATALOG_CHECK_INTERVAL', 3600)
+    CrudUtils.sync_parks([{'id': 1, 'name': 'Park 1'}])
+    catalog.invalidate()
+    loaded = catalog.get_catalog()
+    CrudUtils.sync_parks([{'id': 1, 'name': 'Park 1'}, {'id': 2, 'name': 'Park 2'}])
+    assert catalog.get_catalog() is loaded
@@ -0,0 +1,61 @@
+import time
+from twilio.base.exceptions import TwilioRestException
+from benchmarks.fake_queue_times import FakeQueueTimes, serve
+import controllers.cronjobs as cronjobs
+from utils.postgres import CrudUtils
+import utils.sms as sms
+import env
+
+
+def test_close_out_alerts_retries_alerts_an_earlier_pass_released(db):
+    transport = sms.set_transport(sms.StubTransport()).transport
+    CrudUtils.create_park(id=1, name='Park 1')
+    CrudUtils.bulk_upsert_rides(park_id=1, rides=[{'id': 10, 'name': 'Ride 10', 'wait_time': 15, 'is_open': True}])
+    CrudUtils.create_alert(id='a', ride_id=10, park_id=1, phone_number='+15555550100', wait_time=30, expiration=int(time.time()) + 3600)
+    CrudUtils.create_alert(id='b', ride_id=10, park_id=1, phone_number='+15555550101', wait_time=20, expiration=int(time.time()) + 3600)
+    # ingestion triggered 'a' but its sms didn't go through
+    CrudUtils.close_alerts(now=int(time.time()) - 1, notify=lambda closed: [], alert_ids=['a'])
+
+    cronjobs.close_out_alerts()
+
+    # 'b' is fulfilled too, but no pass has claimed it - that's ingestion's job, not the sweep's
+    assert [a.id for a in CrudUtils.read_alerts()] == ['b']
+    assert transport.sent == [('+15555550100', 'The line for Ride 10 is currently 15 minutes! This alert is no longer active.')]
+
+
+class RejectingTransport:
+    def __init__(self):
+        self.attempts = 0
+
+    def send(self, recipient:str, msg:str) -> str:
+        self.attempts += 1
+        raise TwilioRestException(400, 'https://api.twilio.com', msg='Attempt to send to unsubscribed recipient', code=21610)
+
+
+def test_close_out_alerts_drops_alerts_twilio_rejects(db):
+    transport = sms.set_transport(RejectingTransport()).transport
+    CrudUtils.create_park(id=1, name='Park 1')
+    CrudUtils.bulk_upsert_rides(park_id=1, rides=[{'id': 10, 'name': 'Ride 10', 'wait_time': 45, 'is_open': True}])
+    CrudUtils.create_alert(id='a', ride_id=10, park_id=1, phone_number='+15555550100', wait_time=30, expiration=int(time.time()) - 60)
+
+    for _ in range(3):
+        cronjobs.close_out_alerts()
+
+    # a permanent rejection settles the alert, rather than releasing it to be retried every pass
+    assert CrudUtils.read_alerts() == []
+    assert transport.attempts == 1
+
+
+def test_fetch_parks_json_applies_a_withheld_removal_once_confirmed(db, monkeypatch):
+    fake = FakeQueueTimes(num_parks=10, latency=0)
+    with serve(fake) as url:
+        monkeypatch.setattr(env, 'QUEUE_TIMES_URL', url)
+        monkeypatch.setattr(cronjobs, '_parks_headers', {})
+        monkeypatch.setattr(cronjobs, '_parks_state', {})
+        cronjobs.fetch_parks_json()
+        fake.num_parks = 5
+        for _ in range(cronjobs.PARKS_CONFIRM_RUNS - 1):
+            cronjobs.fetch_parks_json()
+            assert len(CrudUtils.read_parks()) == 10
+        cronjobs.fetch_parks_json()
+    assert sorted(p.id for p in CrudUtils.read_parks()) == [1, 2, 3, 4, 5]
@@ -0,0 +1,10 @@
+import os
+import subprocess
+import sys
+
+
+def test_web_process_does_not_import_pandas():
+    # pandas is for the worker's nightly fit, the webhook only needs estimate()
+    code = 'import sys, controllers.subscribe; sys.exit("pandas" in sys.modules)'
+    env = {**os.environ, 'TWILIO_AUTH_TOKEN': os.environ.get('TWILIO_AUTH_TOKEN', 'test')}
+    assert subprocess.run([sys.executable, '-c', code], env=env, cwd=os.path.dirname(os.path.dirname(__file__))).returncode == 0
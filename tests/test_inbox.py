@@ -0,0 +1,27 @@
+import asyncio
+from utils import inbox, sms
+
+
+def test_one_senders_messages_are_handled_in_order(db, monkeypatch):
+    transport = sms.set_transport(sms.StubTransport()).transport
+    handled = []
+    async def process_message(msg:str, phone_number:str) -> str:
+        # the first message is the slowest, so any concurrency would let the later ones overtake it
+        await asyncio.sleep({'watch': 0.2, 'change': 0.1, 'cancel': 0}[msg])
+        handled.append((phone_number, msg))
+        return f"done {msg}"
+    monkeypatch.setattr(sms, 'process_message', process_message)
+
+    async def run():
+        for i, msg in enumerate(['watch', 'change', 'cancel']):
+            assert inbox.submit(f"SM{i}", msg, '+15555550100')
+        inbox.submit('SM3', 'cancel', '+15555550101')
+        await asyncio.gather(*(queue.join() for queue in inbox._queues))
+        for task in list(inbox._workers.values()):
+            task.cancel()
+    asyncio.run(run())
+    inbox._queues.clear()
+
+    assert [msg for number, msg in handled if number == '+15555550100'] == ['watch', 'change', 'cancel']
+    sms.get_outbox()._executor.shutdown(wait=True)
+    assert sorted(msg for number, msg in transport.sent) == ['done cancel', 'done cancel', 'done change', 'done watch']
@@ -0,0 +1,26 @@
+import asyncio
+import threading
+from utils import metrics
+
+
+def test_delta_only_counts_its_own_context():
+    histogram = metrics.histogram('test_delta_seconds', 'Test histogram')
+    inside = threading.Barrier(2)
+    results = {}
+
+    def job(name:str, observations:int):
+        with metrics.delta() as changes:
+            inside.wait()
+            for _ in range(observations):
+                histogram.observe(0.5)
+            # work handed to a thread from inside the job still counts towards it
+            asyncio.run(asyncio.to_thread(histogram.observe, 1.0))
+            inside.wait()
+        results[name] = changes['test_delta_seconds']
+
+    threads = [threading.Thread(target=job, args=('a', 2)), threading.Thread(target=job, args=('b', 5))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == {'a': (3, 2.0), 'b': (6, 3.5)}
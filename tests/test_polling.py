@@ -0,0 +1,53 @@
+from utils import polling
+from utils.polling import PollScheduler
+
+
+def test_intervals_follow_watchers_status_and_volatility():
+    scheduler = PollScheduler()
+    assert scheduler.due([1, 2, 3], watchers={1: 2}, now=0) == [1, 2, 3]
+    scheduler.observe(1, rides=10, changed=10, is_open=True)
+    scheduler.observe(2, rides=10, changed=0, is_open=True)
+    scheduler.observe(3, rides=10, changed=0, is_open=False)
+    assert scheduler.reschedule(1, ok=True, changed=True, now=0) == polling.WATCHED_VOLATILE_INTERVAL
+    # new parks start out volatile, so it takes a few calm polls to settle
+    assert scheduler.reschedule(2, ok=True, changed=True, now=0) == polling.OPEN_VOLATILE_INTERVAL
+    scheduler.observe(2, rides=10, changed=0, is_open=True)
+    scheduler.observe(2, rides=10, changed=0, is_open=True)
+    assert scheduler.reschedule(2, ok=True, changed=False, now=0) == polling.OPEN_INTERVAL
+    assert scheduler.reschedule(3, ok=True, changed=True, now=0) == polling.CLOSED_INTERVAL
+    # park 3 hasn't settled yet either, but closed parks ignore volatility
+    assert scheduler.stats() == {'parks': 3, 'watched': 1, 'closed': 1, 'volatile': 2, 'failing': 0}
+
+
+def test_only_due_parks_are_returned_and_new_alerts_promote_a_park():
+    scheduler = PollScheduler()
+    scheduler.due([1, 2], watchers={}, now=0)
+    scheduler.observe(1, rides=10, changed=0, is_open=False)
+    scheduler.observe(2, rides=10, changed=0, is_open=False)
+    scheduler.reschedule(1, ok=True, changed=True, now=0)
+    scheduler.reschedule(2, ok=True, changed=True, now=0)
+    assert scheduler.due([1, 2], watchers={}, now=60) == []
+    # an alert on park 2 makes it due straight away, and closed + watched polls more often
+    assert scheduler.due([1, 2], watchers={2: 1}, now=60) == [2]
+    assert scheduler.reschedule(2, ok=True, changed=False, now=60) == polling.CLOSED_WATCHED_INTERVAL
+    # the same watcher count doesn't promote it again
+    assert scheduler.due([1, 2], watchers={2: 1}, now=120) == []
+    assert scheduler.due([1, 2], watchers={2: 1}, now=60 + polling.CLOSED_WATCHED_INTERVAL) == [2]
+    assert scheduler.due([1, 2], watchers={2: 1}, now=polling.CLOSED_INTERVAL) == [1, 2]
+
+
+def test_failures_back_off_exponentially_up_to_the_closed_interval():
+    scheduler = PollScheduler()
+    scheduler.due([1], watchers={1: 1}, now=0)
+    intervals = [scheduler.reschedule(1, ok=False, changed=False, now=0) for _ in range(7)]
+    assert intervals == [60, 120, 240, 480, 960, polling.CLOSED_INTERVAL, polling.CLOSED_INTERVAL]
+    assert scheduler.stats()['failing'] == 1
+    # one good poll resets the backoff
+    assert scheduler.reschedule(1, ok=True, changed=True, now=0) == polling.WATCHED_VOLATILE_INTERVAL
+
+
+def test_parks_no_longer_listed_are_forgotten():
+    scheduler = PollScheduler()
+    scheduler.due([1, 2], watchers={}, now=0)
+    scheduler.due([1], watchers={}, now=0)
+    assert list(scheduler.parks) == [1]
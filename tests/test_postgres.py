@@ -0,0 +1,63 @@
+from sqlalchemy import text
+from utils.postgres import CrudUtils
+
+
+def ride(id:int, wait_time:int, is_open:bool=True) -> dict:
+    return {'id': id, 'name': f"Ride {id}", 'wait_time': wait_time, 'is_open': is_open}
+
+
+def test_bulk_upsert_rides_reports_previous_waits(db):
+    CrudUtils.create_park(id=1, name='Park 1')
+    CrudUtils.create_park(id=2, name='Park 2')
+    first = CrudUtils.bulk_upsert_rides(park_id=1, rides=[ride(10, 30), ride(11, 45), ride(12, 5)])
+    CrudUtils.bulk_upsert_rides(park_id=2, rides=[ride(20, 60), ride(21, 15)])
+    assert sorted((c.ride_id, c.old_wait_time, c.wait_time) for c in first) == [(10, None, 30), (11, None, 45), (12, None, 5)]
+
+    # unchanged rows are skipped, changed ones report their pre-update wait
+    changes = CrudUtils.bulk_upsert_rides(park_id=1, rides=[ride(10, 20), ride(11, 45), ride(12, 5, is_open=False), ride(13, 10)])
+    assert sorted((c.ride_id, c.old_wait_time, c.wait_time, c.is_open) for c in changes) == [
+        (10, 30, 20, True),
+        (12, 5, 5, False),
+        (13, None, 10, True),
+    ]
+    assert {r.id:r.wait_time for r in CrudUtils.read_rides(park_id=1)} == {10: 20, 11: 45, 12: 5, 13: 10}
+
+
+def test_close_alerts_holds_no_locks_while_notifying(db):
+    CrudUtils.create_park(id=1, name='Park 1')
+    CrudUtils.bulk_upsert_rides(park_id=1, rides=[ride(10, 15)])
+    CrudUtils.create_alert(id='a', ride_id=10, park_id=1, phone_number='+15555550100', wait_time=30, expiration=2000000000)
+    CrudUtils.create_alert(id='b', ride_id=10, park_id=1, phone_number='+15555550101', wait_time=20, expiration=2000000000)
+
+    def notify(claimed):
+        # a webhook editing a claimed alert goes straight through, and a concurrent pass finds nothing to claim
+        with db.begin() as connection:
+            connection.execute(text("SET LOCAL lock_timeout = '1s'"))
+            connection.execute(text("UPDATE alerts SET wait_time = 25 WHERE id = 'b'"))
+        assert CrudUtils.close_alerts(now=1000, notify=lambda c: [a.id for a in c]) == []
+        return ['a']
+
+    closed = CrudUtils.close_alerts(now=1000, notify=notify)
+    assert [c.id for c in closed] == ['a']
+    # unacknowledged alerts are released for the next pass, and stay marked for the expiry sweep
+    assert [(a.id, a.claimed_until) for a in CrudUtils.read_alerts()] == [('b', 1000)]
+    assert [c.id for c in CrudUtils.close_alerts(now=1001, notify=lambda c: [a.id for a in c], include_fulfilled=False)] == ['b']
+
+
+def test_sync_parks_applies_the_diff_and_withholds_mass_removals(db):
+    CrudUtils.sync_parks([{'id': p, 'name': f"Park {p}"} for p in range(1, 11)])
+    CrudUtils.bulk_upsert_rides(park_id=10, rides=[ride(100, 30)])
+    CrudUtils.create_alert(id='a', ride_id=100, park_id=10, phone_number='+15555550100', wait_time=20, expiration=2000000000)
+
+    parks = [{'id': p, 'name': f"Park {p}"} for p in range(1, 10)] + [{'id': 11, 'name': 'Park 11'}]
+    parks[0] = {'id': 1, 'name': 'Park One', 'timezone': 'America/New_York'}
+    summary = CrudUtils.sync_parks(parks, max_removed_share=0.2)
+    assert (summary.created, summary.updated, summary.removed, summary.unchanged, summary.withheld) == ([11], [1], [10], 8, [])
+    assert {p.id:(p.name, p.timezone) for p in CrudUtils.read_parks()}[1] == ('Park One', 'America/New_York')
+    # a removed park takes its rides + alerts with it
+    assert CrudUtils.read_rides() == [] and CrudUtils.read_alerts() == []
+
+    # a payload missing more than the allowed share removes nothing, its creates + renames still apply
+    summary = CrudUtils.sync_parks([{'id': 1, 'name': 'Park 1'}], max_removed_share=0.2)
+    assert (summary.updated, summary.removed, summary.withheld) == ([1], [], list(range(2, 10)) + [11])
+    assert len(CrudUtils.read_parks()) == 10
@@ -0,0 +1,37 @@
+import asyncio
+from benchmarks.fake_queue_times import FakeQueueTimes, serve
+from utils import queuetimes
+
+
+def fetch(url:str, park_ids:list, handler) -> list:
+    return asyncio.run(queuetimes.fetch_wait_times(park_ids, handler=handler, base_url=url))
+
+
+def test_unchanged_payloads_skip_the_handler(monkeypatch):
+    monkeypatch.setattr(queuetimes, 'PARK_STATE', {})
+    fake = FakeQueueTimes(num_parks=3, rides_per_park=2, latency=0)
+    written = []
+    handler = lambda park_id, payload: written.append(park_id)
+    with serve(fake) as url:
+        assert [(r.park_id, r.ok, r.changed) for r in fetch(url, [1, 2], handler)] == [(1, True, True), (2, True, True)]
+        fake.publish([2])
+        # park 1 answers 304 to its etag, park 2 has new waits
+        assert [(r.ok, r.changed) for r in fetch(url, [1, 2], handler)] == [(True, False), (True, True)]
+        # a server that ignores the validators still gets caught by the content hash
+        monkeypatch.setitem(queuetimes.PARK_STATE, 1, queuetimes.PARK_STATE[1]._replace(etag=None))
+        before = queuetimes.cache_stats()
+        assert [(r.ok, r.changed) for r in fetch(url, [1], handler)] == [(True, False)]
+        assert queuetimes.cache_stats()['unchanged'] == before['unchanged'] + 1
+    assert written == [1, 2, 2]
+
+
+def test_a_failed_write_is_retried_next_cycle(monkeypatch):
+    monkeypatch.setattr(queuetimes, 'PARK_STATE', {})
+    fake = FakeQueueTimes(num_parks=1, rides_per_park=2, latency=0)
+    def failing(park_id, payload):
+        raise RuntimeError('db down')
+    written = []
+    with serve(fake) as url:
+        assert [(r.ok, r.changed) for r in fetch(url, [1], failing)] == [(False, False)]
+        assert [(r.ok, r.changed) for r in fetch(url, [1], lambda park_id, payload: written.append(payload))] == [(True, True)]
+    assert len(written[0]['lands'][0]['rides']) == 2
@@ -0,0 +1,74 @@
+import asyncio
+import pytest
+import utils.catalog as catalog
+from utils.postgres import async_engine, ClosedAlert, CrudUtils
+import utils.sms as sms
+
+
+def test_process_message_reports_the_current_wait_not_the_catalogs(db):
+    pytest.importorskip('en_core_web_sm')
+    CrudUtils.create_park(id=1, name='Kings Island')
+    CrudUtils.bulk_upsert_rides(park_id=1, rides=[{'id': 10, 'name': 'The Beast', 'wait_time': 60, 'is_open': True}])
+    catalog.invalidate()
+    catalog.get_catalog()
+    # the worker writes a new wait after the web process cached its catalog
+    CrudUtils.bulk_upsert_rides(park_id=1, rides=[{'id': 10, 'name': 'The Beast', 'wait_time': 10, 'is_open': True}])
+
+    async def run():
+        try:
+            return await sms.process_message('let me know when the beast at kings island is below 30', '+15555550100')
+        finally:
+            await async_engine.dispose()
+
+    reply = asyncio.run(run())
+    assert reply == 'The wait time for The Beast is currently 10 minutes.'
+    assert CrudUtils.read_alerts() == []
+
+
+def test_shared_rate_limit_spans_outboxes(db):
+    from concurrent.futures import ThreadPoolExecutor
+    import time
+    # two limiters stand in for two processes sending from the same number
+    limiters = [sms.SharedRateLimit(rate=20, key='+15555550100') for _ in range(2)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=10) as pool:
+        list(pool.map(lambda i: limiters[i % 2].acquire(), range(10)))
+    # the first slot is free, the other nine are 1/20s apart
+    assert time.perf_counter() - start >= 9 / 20 - 0.01
+
+
+def alert(id:str, ride_name:str, expired:bool=False) -> ClosedAlert:
+    return ClosedAlert(id, '+15555550100', ride_name, 15, 30, expired)
+
+
+def test_sms_segments_counts_gsm_7_and_ucs_2():
+    assert sms.sms_segments('a' * 160) == 1
+    assert sms.sms_segments('a' * 161) == 2
+    assert sms.sms_segments('a' * 306) == 2
+    # extended characters take two septets
+    assert sms.sms_segments('€' * 80) == 1
+    assert sms.sms_segments('€' * 81) == 2
+    # anything outside gsm-7 switches the whole message to ucs-2, astral characters taking two units
+    assert sms.sms_segments('é' * 160 + 'ł') == 3
+    assert sms.sms_segments('ł' * 70) == 1
+    assert sms.sms_segments('🎢' * 35) == 1
+    assert sms.sms_segments('🎢' * 36) == 2
+
+
+def test_alert_messages_keeps_single_alerts_as_before():
+    assert sms.alert_messages([alert('a', 'The Beast ')]) == ['The line for The Beast is currently 15 minutes! This alert is no longer active.']
+    assert sms.alert_messages([alert('a', 'The Beast', expired=True)]) == ['Your alert for The Beast has expired! The line did not get shorter than 30 minutes.']
+
+
+def test_alert_messages_packs_whole_lines_within_the_segment_cap():
+    alerts = [alert(str(i), f"Ride With A Fairly Long Name Number {i}", expired=i % 2 == 0) for i in range(30)]
+    messages = sms.alert_messages(alerts)
+    assert len(messages) > 1
+    for msg in messages:
+        assert msg.startswith(sms.DIGEST_HEADER + '\n')
+        assert sms.sms_segments(msg) <= sms.MAX_SEGMENTS
+    lines = [line for msg in messages for line in msg.split('\n')[1:]]
+    assert lines == [
+        f"- Ride With A Fairly Long Name Number {i}: " + ('expired, never under 30 min' if i % 2 == 0 else 'line is 15 min now')
+        for i in range(30)
+    ]
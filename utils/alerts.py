@@ -0,0 +1,37 @@
+from bisect import bisect_left, insort
+from typing import Dict, Iterable, List, Optional, Tuple
+from .postgres import Alert, RideChange, CrudUtils
+
+
+# snapshot of active alerts, keyed by ride and sorted by wait threshold
+class AlertIndex:
+    def __init__(self, alerts:Iterable[Alert]=()):
+        self._by_ride:Dict[int, List[Tuple[int, str]]] = {}
+        for alert in alerts:
+            insort(self._by_ride.setdefault(alert.ride_id, []), (alert.wait_time, alert.id))
+
+    @classmethod
+    def load(cls, park_ids:Optional[List[int]]=None) -> 'AlertIndex':
+        if park_ids is None:
+            return cls(CrudUtils.read_alerts())
+        return cls(CrudUtils.read_alerts_in_parks(park_ids))
+
+    def __len__(self) -> int:
+        return sum(len(alerts) for alerts in self._by_ride.values())
+
+    # ids of alerts on this ride watching for a wait at or above the given one
+    def triggered_by(self, ride_id:int, wait_time:int) -> List[str]:
+        alerts = self._by_ride.get(ride_id)
+        if not alerts:
+            return []
+        start = bisect_left(alerts, (wait_time, ''))
+        return [alert_id for _, alert_id in alerts[start:]]
+
+    # only rides whose wait dropped can newly satisfy an alert
+    def evaluate(self, changes:Iterable[RideChange]) -> List[str]:
+        triggered = []
+        for change in changes:
+            if change.old_wait_time is not None and change.wait_time >= change.old_wait_time:
+                continue
+            triggered.extend(self.triggered_by(change.ride_id, change.wait_time))
+        return triggered
@@ -0,0 +1,78 @@
+import threading
+import time
+from typing import Dict, Iterable, List, Tuple
+from . import metrics
+from .matching import NameIndex
+from .postgres import Park, Ride, CrudUtils
+import env
+
+
+# process-wide snapshot of parks + rides for name matching, so the sms path doesn't scan the tables for every message
+# the jobs that change them run in another process and bump the catalog version, which each process checks at most
+# every CATALOG_CHECK_INTERVAL - waits change without a bump, so never trust them, process_message re-reads the matched ride
+class Catalog:
+    def __init__(self, parks:List[Park], rides:List[Ride], version:int, previous:'Catalog'=None):
+        self.version = version
+        self.checked_at = time.time() # when the version was last confirmed current
+        # sorted by id - table order shifts as rows are updated, which would change the index keys below
+        self.parks = sorted(parks, key=lambda p: p.id)
+        # name indexes keyed by their names, carried over from the previous snapshot so a reload only rebuilds what changed
+        self.indexes:Dict[Tuple[str, ...], NameIndex] = {}
+        reuse = {} if previous is None else previous.indexes
+        def index(names:Iterable[str]) -> NameIndex:
+            key = tuple(names)
+            if key not in self.indexes:
+                self.indexes[key] = reuse[key] if key in reuse else NameIndex(key)
+            return self.indexes[key]
+        self.park_index = index(p.name for p in self.parks)
+        self.rides_by_park:Dict[int, List[Ride]] = {}
+        for ride in sorted(rides, key=lambda r: r.id):
+            self.rides_by_park.setdefault(ride.park_id, []).append(ride)
+        # normalized name indexes, positions line up with self.parks / self.rides(park_id)
+        self.ride_indexes = {park_id:index(r.name for r in rides) for park_id, rides in self.rides_by_park.items()}
+
+    def rides(self, park_id:int) -> List[Ride]:
+        return self.rides_by_park.get(park_id, [])
+
+    def ride_index(self, park_id:int) -> NameIndex:
+        return self.ride_indexes.get(park_id, EMPTY_INDEX)
+
+    @property
+    def staleness(self) -> float:
+        return time.time() - self.checked_at
+
+
+EMPTY_INDEX = NameIndex([])
+
+
+_catalog = None
+_forced = False
+_lock = threading.Lock()
+
+
+def get_catalog() -> Catalog:
+    global _catalog, _forced
+    catalog = _catalog
+    if catalog is None or _forced or catalog.staleness >= env.CATALOG_CHECK_INTERVAL:
+        with _lock:
+            # another thread may have checked while we waited
+            catalog = _catalog
+            if catalog is None or _forced or catalog.staleness >= env.CATALOG_CHECK_INTERVAL:
+                # one primary key read, the tables are only reloaded when the version moved
+                version = CrudUtils.read_catalog_version()
+                if catalog is None or _forced or catalog.version != version:
+                    metrics.CATALOG_LOOKUPS.inc(outcome='miss')
+                    _catalog = Catalog(CrudUtils.read_parks(), CrudUtils.read_rides(), version, previous=catalog)
+                    _forced = False
+                    return _catalog
+                catalog.checked_at = time.time()
+    metrics.CATALOG_LOOKUPS.inc(outcome='hit')
+    metrics.CATALOG_STALENESS_SECONDS.observe(catalog.staleness)
+    return catalog
+
+
+# forces a reload on the next get_catalog() in this process, for changes made without bumping the version
+def invalidate():
+    global _forced
+    with _lock:
+        _forced = True
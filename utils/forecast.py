@@ -0,0 +1,73 @@
+import datetime
+import functools
+from typing import Dict, NamedTuple, Optional, Tuple
+from zoneinfo import ZoneInfo
+import numpy as np
+from .postgres import CrudUtils
+
+
+QUANTILES = [0.05, 0.1, 0.25, 0.5, 0.75, 0.9, 0.95]
+HORIZON = 6 # hours ahead considered when estimating a drop
+MIN_SAMPLES = 12 # slots with less history than this are ignored
+LIKELY = 0.5 # per-slot probability that counts as the line dropping
+UNLIKELY = 0.05 # overall probability below which alerts get the shortest expiration
+DEFAULT_EXPIRATION = 2 * 3600 # no usable history
+MIN_EXPIRATION = 1 * 3600
+MAX_EXPIRATION = HORIZON * 3600
+
+
+class Estimate(NamedTuple):
+    probability: Optional[float] # chance the wait drops to the threshold within HORIZON, None without history
+    eta: Optional[int] # epoch seconds of the first slot where a drop is likely
+    expiration: int
+
+
+# estimates read the quantiles history.compute_forecasts() stores - no pandas here, this runs in the web process
+# probability + eta of the line dropping to the threshold, and the expiration that follows from them
+def estimate(ride_id:int, threshold:int, timezone:Optional[str], now:int) -> Estimate:
+    slots = _slots(ride_id, now // 3600)
+    if len(slots) == 0 or threshold is None:
+        return Estimate(None, None, now + DEFAULT_EXPIRATION)
+    local = datetime.datetime.fromtimestamp(now, ZoneInfo(timezone or 'UTC'))
+    miss, eta = 1.0, None
+    for h in range(HORIZON):
+        slot = local + datetime.timedelta(hours=h)
+        quantiles = slots.get((slot.weekday(), slot.hour))
+        if quantiles is None:
+            continue
+        # piecewise-linear cdf through the stored quantiles
+        p = float(np.interp(threshold, quantiles, QUANTILES, left=0.0, right=1.0))
+        miss *= 1 - p
+        if eta is None and p >= LIKELY:
+            eta = now if h == 0 else int(slot.replace(minute=0, second=0, microsecond=0).timestamp())
+    probability = 1 - miss
+    if eta is not None:
+        # give it the hour the drop is expected in
+        expiration = min(max(eta + 3600, now + MIN_EXPIRATION), now + MAX_EXPIRATION)
+    elif probability < UNLIKELY:
+        expiration = now + MIN_EXPIRATION
+    else:
+        expiration = now + MAX_EXPIRATION
+    return Estimate(probability, eta, expiration)
+
+
+# one-line hint for the sms reply, empty without history
+def describe(estimate:Estimate, timezone:Optional[str]) -> str:
+    if estimate.probability is None:
+        return ''
+    if estimate.eta is not None:
+        eta = datetime.datetime.fromtimestamp(estimate.eta, ZoneInfo(timezone or 'UTC'))
+        return f" Based on past waits, it's likely to get there around {eta.hour % 12 or 12}:{eta.minute:02d} {'AM' if eta.hour < 12 else 'PM'}."
+    if estimate.probability < UNLIKELY:
+        return " Heads up: it rarely gets that short around this time, so this alert expires in an hour."
+    return ''
+
+
+# forecasts change daily, so caching per ride per clock hour keeps message handling to one query per ride/hour
+@functools.lru_cache(maxsize=1024)
+def _slots(ride_id:int, hour_bucket:int) -> Dict[Tuple[int, int], list]:
+    return {
+        (f.day_of_week, f.hour): f.quantiles
+        for f in CrudUtils.read_forecasts(ride_id)
+        if f.samples >= MIN_SAMPLES
+    }
@@ -0,0 +1,86 @@
+import datetime
+import logging
+from typing import List, Optional
+import pandas as pd
+from .forecast import QUANTILES
+from .postgres import CrudUtils
+import env
+
+
+logger = logging.getLogger('uvicorn')
+
+
+KEYS = ['ride_id', 'day_of_week', 'hour']
+
+
+# (ride_id, ts, wait_time, is_open) samples for one park payload, ready for CrudUtils.copy_ride_waits
+def samples(rides:List[dict], ts:int) -> List[tuple]:
+    return [(r['id'], ts, r['wait_time'], r['is_open']) for r in rides]
+
+
+# per-slot value counts of open waits over the retained history, read one day partition at a time
+def slot_counts(days:int=env.HISTORY_RETENTION_DAYS, today:datetime.date=None) -> pd.DataFrame:
+    today = today or datetime.datetime.utcnow().date()
+    timezones = pd.Series(CrudUtils.read_ride_timezones(), dtype='object').fillna('UTC')
+    # waits are whole minutes, so per-slot value counts are small and merge exactly across days
+    counts = None
+    for offset in range(days, 0, -1):
+        day = today - datetime.timedelta(days=offset)
+        start = int(datetime.datetime(day.year, day.month, day.day, tzinfo=datetime.timezone.utc).timestamp())
+        df = pd.read_csv(CrudUtils.export_ride_waits(start, start + 86400))
+        if df.empty:
+            continue
+        day_counts = _local_slots(df, timezones).groupby(KEYS + ['wait_time']).size()
+        counts = day_counts if counts is None else counts.add(day_counts, fill_value=0)
+    if counts is None:
+        return pd.DataFrame(columns=KEYS + ['wait_time', 'samples'])
+    return counts.astype(int).rename('samples').reset_index()
+
+
+# rebuild ride_wait_rollups from slot_counts()
+def compute_rollups(counts:pd.DataFrame) -> int:
+    if counts.empty:
+        return CrudUtils.replace_rollups([])
+    rollups = quantile_from_counts(counts, 0.5).rename(columns={'wait_time': 'median_wait'})
+    return CrudUtils.replace_rollups(rollups.to_dict('records'))
+
+
+# rebuild ride_wait_forecasts from slot_counts() - wait quantiles per ride/day/hour, read by forecast.estimate()
+def compute_forecasts(counts:pd.DataFrame) -> int:
+    if counts.empty:
+        return CrudUtils.replace_forecasts([])
+    fitted = counts.groupby(KEYS)['samples'].sum().rename('samples').reset_index()
+    for q in QUANTILES:
+        fitted = fitted.merge(quantile_from_counts(counts, q)[KEYS + ['wait_time']].rename(columns={'wait_time': q}), on=KEYS)
+    rows = fitted[KEYS + ['samples']].to_dict('records')
+    for row, quantiles in zip(rows, fitted[QUANTILES].astype(int).values.tolist()):
+        row['quantiles'] = quantiles
+    return CrudUtils.replace_forecasts(rows)
+
+
+# ts -> park-local day of week + hour, vectorized per timezone
+def _local_slots(df:pd.DataFrame, timezones:pd.Series) -> pd.DataFrame:
+    utc = pd.to_datetime(df['ts'], unit='s', utc=True)
+    df = df.assign(day_of_week=0, hour=0)
+    for tz, rows in df.groupby(df['ride_id'].map(timezones).fillna('UTC')).groups.items():
+        local = utc[rows].dt.tz_convert(tz)
+        df.loc[rows, 'day_of_week'] = local.dt.dayofweek
+        df.loc[rows, 'hour'] = local.dt.hour
+    return df
+
+
+# first wait per slot whose cumulative share of samples reaches q, plus the slot's total samples
+def quantile_from_counts(counts:pd.DataFrame, q:float) -> pd.DataFrame:
+    counts = counts.sort_values(KEYS + ['wait_time'])
+    slots = counts.groupby(KEYS)['samples']
+    counts = counts.assign(cumulative=slots.cumsum(), total=slots.transform('sum'))
+    hits = counts[counts['cumulative'] >= q * counts['total']].groupby(KEYS).head(1)
+    return hits[KEYS + ['wait_time', 'total']].rename(columns={'total': 'samples'})
+
+
+# "typical wait for this ride at 3pm saturday", from the precomputed rollups
+def typical_wait(ride_id:int, day_of_week:int, hour:int) -> Optional[float]:
+    rollup = CrudUtils.read_rollup(ride_id, day_of_week, hour)
+    if rollup is None:
+        return None
+    return rollup.median_wait
@@ -0,0 +1,79 @@
+import asyncio
+from collections import OrderedDict
+import logging
+import time
+from typing import Dict, List, NamedTuple
+from . import metrics, sms
+from .postgres import AsyncCrudUtils, count_queries
+import env
+
+
+logger = logging.getLogger('uvicorn')
+
+
+RECENT_LIMIT = 10000 # sids remembered in memory per web worker
+
+
+# inbound message acked to twilio, waiting for a background worker
+class InboundSMS(NamedTuple):
+    sid: str
+    body: str
+    phone_number: str
+    received_at: float
+
+
+_recent = OrderedDict() # sids this process already accepted, oldest first
+# one queue per background task, a sender always lands on the same one - so their messages are handled in order
+_queues:List[asyncio.Queue] = []
+_workers:Dict[int, asyncio.Task] = {}
+
+
+# queue a message for background handling, false for a retry this process has already seen - no i/o, so the ack stays fast
+def submit(sid:str, body:str, phone_number:str) -> bool:
+    if sid in _recent:
+        metrics.INBOX_RESULTS.inc(outcome='duplicate')
+        return False
+    _recent[sid] = None
+    while len(_recent) > RECENT_LIMIT:
+        _recent.popitem(last=False)
+    _start_workers()
+    _queues[hash(phone_number) % len(_queues)].put_nowait(InboundSMS(sid, body, phone_number, time.perf_counter()))
+    return True
+
+
+# started lazily on the first message, inside the app's event loop
+def _start_workers():
+    if len(_queues) == 0:
+        _queues.extend(asyncio.Queue() for _ in range(env.WEBHOOK_WORKERS))
+    for i, queue in enumerate(_queues):
+        if i not in _workers:
+            task = asyncio.get_running_loop().create_task(_work(queue))
+            _workers[i] = task
+            task.add_done_callback(lambda _, i=i: _workers.pop(i, None))
+
+
+async def _work(queue:asyncio.Queue):
+    while True:
+        message = await queue.get()
+        try:
+            await _handle(message)
+        except Exception:
+            metrics.INBOX_RESULTS.inc(outcome='failed')
+            logger.exception(f"Failed to handle message {message.sid}")
+        finally:
+            queue.task_done()
+
+
+async def _handle(message:InboundSMS):
+    # the durable check - catches retries that landed on another web worker
+    if not await AsyncCrudUtils.claim_inbound_message(message.sid, now=int(time.time())):
+        metrics.INBOX_RESULTS.inc(outcome='duplicate')
+        logger.info(f"Dropped duplicate message {message.sid}")
+        return
+    with count_queries() as queries:
+        reply = await sms.process_message(message.body, message.phone_number)
+    # the sid doubles as the idempotency key, so the reply goes out at most once per process
+    sms.get_outbox().submit(message.phone_number, reply, key=message.sid)
+    metrics.INBOX_SECONDS.observe(time.perf_counter() - message.received_at)
+    metrics.INBOX_RESULTS.inc(outcome='processed')
+    logger.info(f"Response message for {message.sid}: <<{reply}>> ({queries.count} queries)")
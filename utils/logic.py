@@ -1,10 +1,13 @@
+from typing import List
 import uuid
-from .postgres import Park, Ride, CrudUtils
+from .forecast import Estimate, describe
+from .postgres import Alert, Park, Ride, AsyncCrudUtils
 
 
-def alert_creation_flow(ride:Ride, park:Park, phone_number:str, wait_time:int, expiration:int) -> str:
+async def alert_creation_flow(ride:Ride, park:Park, phone_number:str, wait_time:int, expiration:int, estimate:Estimate=None) -> str:
     alert_id = str(uuid.uuid4())
-    active_alerts = CrudUtils.read_alerts(phone_number=phone_number, ride_id=ride.id)
+    hint = '' if estimate is None else describe(estimate, park.timezone)
+    active_alerts = await AsyncCrudUtils.read_alerts(phone_number=phone_number, ride_id=ride.id)
 
     # don't create alert if ride is not open
     if not ride.is_open:
@@ -16,12 +19,12 @@ def alert_creation_flow(ride:Ride, park:Park, phone_number:str, wait_time:int, e
 
     # update existing alert if one already exists for this ride
     if len(active_alerts) > 0:
-        alert_update_flow(ride=ride, phone_number=phone_number, wait_time=wait_time, expiration=expiration)
-        return f"You're already watching {ride.name}! Updated to watch for a wait under {wait_time} minutes (currently {ride.wait_time} minutes)."
+        await alert_update_flow(ride=ride, phone_number=phone_number, wait_time=wait_time, expiration=expiration, active_alerts=active_alerts)
+        return f"You're already watching {ride.name}! Updated to watch for a wait under {wait_time} minutes (currently {ride.wait_time} minutes).{hint}"
 
     # otherwise write alert to database
     else:
-        CrudUtils.create_alert(
+        await AsyncCrudUtils.create_alert(
             id=alert_id,
             park_id=park.id,
             ride_id=ride.id,
@@ -29,14 +32,16 @@ def alert_creation_flow(ride:Ride, park:Park, phone_number:str, wait_time:int, e
             wait_time=wait_time,
             expiration=expiration,
         )
-        return f"Watching {ride.name} for a wait under {wait_time} minutes (currently {ride.wait_time} minutes). Powered by https://queue-times.com/"
+        return f"Watching {ride.name} for a wait under {wait_time} minutes (currently {ride.wait_time} minutes).{hint} Powered by https://queue-times.com/"
 
 
-def alert_update_flow(ride:Ride, phone_number:str, wait_time:int, expiration:int) -> str:
-    active_alerts = CrudUtils.read_alerts(phone_number=phone_number, ride_id=ride.id)
+async def alert_update_flow(ride:Ride, phone_number:str, wait_time:int, expiration:int, active_alerts:List[Alert]=None) -> str:
+    # callers that already read this user's alerts for the ride pass them in, saving a second query
+    if active_alerts is None:
+        active_alerts = await AsyncCrudUtils.read_alerts(phone_number=phone_number, ride_id=ride.id)
     # update alert if user already has one open for this ride
     if len(active_alerts) > 0:
-        CrudUtils.update_alerts(
+        await AsyncCrudUtils.update_alerts(
             phone_number=phone_number, 
             ride_id=ride.id, 
             updates={
@@ -49,8 +54,8 @@ def alert_update_flow(ride:Ride, phone_number:str, wait_time:int, expiration:int
         return f"Whoops, you don't have any active alerts for {ride.name}!"
 
 
-def alert_deletion_flow(ride:Ride, phone_number:str) -> str:
-    alerts = CrudUtils.delete_alerts(phone_number=phone_number, ride_id=ride.id)
+async def alert_deletion_flow(ride:Ride, phone_number:str) -> str:
+    alerts = await AsyncCrudUtils.delete_alerts(phone_number=phone_number, ride_id=ride.id)
     if len(alerts) > 0:
         return f"Your alert for {ride.name} has been deleted."
     else:
@@ -0,0 +1,52 @@
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import numpy as np
+from rapidfuzz import fuzz, process
+from rapidfuzz.utils import default_process
+
+
+# prebuilt fuzzy-match index over a fixed list of names, rebuilt only when the list changes
+class NameIndex:
+    def __init__(self, names:Iterable[str]):
+        self.names = [default_process(n) for n in names] # lowercased, punctuation stripped
+        self._trigrams:Dict[str, List[int]] = {}
+        for i, name in enumerate(self.names):
+            for gram in _trigrams(name):
+                self._trigrams.setdefault(gram, []).append(i)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    # best (index, score) for any of the queries, or None if nothing scores above the threshold
+    def match(self, queries:Iterable[str], threshold:float=0) -> Optional[Tuple[int, float]]:
+        queries = [q for q in (default_process(q) for q in queries) if q]
+        if len(queries) == 0 or len(self.names) == 0:
+            return None
+        candidates = self._candidates(queries)
+        best = self._score(queries, candidates)
+        # trigram shortlist is a heuristic - if it finds nothing good enough, fall back to every name
+        if (best is None or best[1] <= threshold) and len(candidates) < len(self.names):
+            best = self._score(queries, range(len(self.names)))
+        if best is None or best[1] <= threshold:
+            return None
+        return best
+
+    def _candidates(self, queries:List[str]) -> List[int]:
+        candidates:Set[int] = set()
+        for query in queries:
+            for gram in _trigrams(query):
+                candidates.update(self._trigrams.get(gram, ()))
+        return sorted(candidates)
+
+    def _score(self, queries:List[str], candidates:Iterable[int]) -> Optional[Tuple[int, float]]:
+        candidates = list(candidates)
+        if len(candidates) == 0:
+            return None
+        # queries x candidates score matrix in one vectorized call
+        scores = process.cdist(queries, [self.names[i] for i in candidates], scorer=fuzz.WRatio)
+        _, col = np.unravel_index(np.argmax(scores), scores.shape)
+        return candidates[col], float(scores.max())
+
+
+def _trigrams(text:str) -> Set[str]:
+    padded = f"  {text} "
+    return {padded[i:i+3] for i in range(len(padded) - 2)}
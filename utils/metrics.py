@@ -0,0 +1,161 @@
+import bisect
+from contextlib import contextmanager
+from contextvars import ContextVar
+import logging
+import threading
+import time
+from typing import Dict, Iterator, List, Tuple
+
+
+logger = logging.getLogger('uvicorn')
+
+
+# seconds, from a single statement up to the whole 5-minute update window
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+COUNT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+# in-process prometheus-style metrics - each process keeps its own, the web app serves them on /metrics
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name:str, description:str):
+        self.name = name
+        self.description = description
+        self._values:Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount:float=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        _credit(self.name, amount, amount)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            return [f"{self.name}{_labels(key)} {value}" for key, value in self._values.items()]
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name:str, description:str, buckets:tuple=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        # labels -> [per-bucket counts (last one is +Inf), count, sum]
+        self._series:Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value:float, **labels):
+        key = tuple(sorted(labels.items()))
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0, 0.0]
+            series[0][i] += 1
+            series[1] += 1
+            series[2] += value
+        _credit(self.name, 1, value)
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for key, (counts, count, total) in self._series.items():
+                cumulative = 0
+                for bound, n in zip(self.buckets + ('+Inf',), counts):
+                    cumulative += n
+                    lines.append(f"{self.name}_bucket{_labels(key + (('le', bound),))} {cumulative}")
+                lines.append(f"{self.name}_count{_labels(key)} {count}")
+                lines.append(f"{self.name}_sum{_labels(key)} {total}")
+        return lines
+
+
+REGISTRY:Dict[str, object] = {}
+
+
+def counter(name:str, description:str) -> Counter:
+    return REGISTRY.setdefault(name, Counter(name, description))
+
+
+def histogram(name:str, description:str, buckets:tuple=LATENCY_BUCKETS) -> Histogram:
+    return REGISTRY.setdefault(name, Histogram(name, description, buckets))
+
+
+# per-stage metrics, shared by the web app + worker
+FETCH_SECONDS = histogram('queuetimes_fetch_seconds', 'Queue-times fetch latency per park, including retries')
+FETCH_RESULTS = counter('queuetimes_fetch_total', 'Queue-times fetches by outcome')
+WRITE_SECONDS = histogram('wait_times_write_seconds', 'Ride upsert time per changed park')
+ALERT_EVALUATION_SECONDS = histogram('alert_evaluation_seconds', 'Time spent matching ride changes against active alerts')
+JOB_SECONDS = histogram('job_seconds', 'Cron job duration')
+JOB_STATEMENTS = histogram('job_db_statements', 'DB statements per cron job run', COUNT_BUCKETS)
+JOB_DB_SECONDS = histogram('job_db_seconds', 'Time spent in DB statements per cron job run')
+DB_STATEMENT_SECONDS = histogram('db_statement_seconds', 'DB statement execution time')
+SMS_SEND_SECONDS = histogram('sms_send_seconds', 'Outbound SMS transport latency per attempt')
+SMS_RESULTS = counter('sms_total', 'Outbound SMS by outcome')
+WEBHOOK_SECONDS = histogram('webhook_seconds', 'Inbound SMS webhook end-to-end latency')
+WEBHOOK_STATEMENTS = histogram('webhook_db_statements', 'DB statements per inbound SMS', COUNT_BUCKETS)
+NLP_SECONDS = histogram('nlp_seconds', 'Message analysis time by stage')
+INBOX_SECONDS = histogram('inbox_seconds', 'Background message handling time, from ack to reply queued')
+INBOX_RESULTS = counter('inbox_total', 'Background inbound messages by outcome')
+CATALOG_LOOKUPS = counter('catalog_lookups_total', 'In-memory park/ride catalog lookups by outcome (a miss reloads it)')
+CATALOG_STALENESS_SECONDS = histogram('catalog_staleness_seconds', 'Time since the catalog served was last checked against the database')
+
+
+# prometheus text exposition format
+def render() -> str:
+    lines = []
+    for metric in REGISTRY.values():
+        lines.append(f"# HELP {metric.name} {metric.description}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# every delta() block currently open in this context, so jobs running side by side each see only their own work
+_deltas:ContextVar[Tuple[Dict[str, Tuple[float, float]], ...]] = ContextVar('metric_deltas', default=())
+_deltas_lock = threading.Lock()
+
+
+def _credit(name:str, count:float, total:float):
+    changes = _deltas.get()
+    if len(changes) == 0:
+        return
+    with _deltas_lock:
+        for result in changes:
+            c, s = result.get(name, (0, 0.0))
+            result[name] = (c + count, s + total)
+
+
+# (count, sum) per metric name, labels folded together, of what was recorded in this context (and the threads +
+# tasks it handed work to) while the block ran - for one-line per-job stage breakdowns in the worker logs
+@contextmanager
+def delta() -> Iterator[Dict[str, Tuple[float, float]]]:
+    result = {}
+    token = _deltas.set(_deltas.get() + (result,))
+    try:
+        yield result
+    finally:
+        _deltas.reset(token)
+
+
+def format_delta(changes:Dict[str, Tuple[float, float]]) -> str:
+    return ' '.join(
+        f"{name}={count:g}x/{total:.3f}" if isinstance(REGISTRY[name], Histogram) else f"{name}={count:g}"
+        for name, (count, total) in sorted(changes.items())
+    )
+
+
+def _labels(key:tuple) -> str:
+    if len(key) == 0:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in key) + '}'
@@ -1,11 +1,63 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import functools
+import multiprocessing
 import re
-from typing import List, Tuple
-import spacy
-from fuzzywuzzy import process as fuzzymatching
-from utils.postgres import Ride, Park, CrudUtils
+import threading
+from typing import NamedTuple, Tuple, Union
+from utils.catalog import get_catalog
+from utils.matching import NameIndex
+from utils.postgres import Ride, Park
+import env
 
 
-NLP = spacy.load('en_core_web_sm')
+# noun chunks need the tagger + parser, nothing reads entities or lemmas
+EXCLUDED_PIPES = ['ner', 'lemmatizer']
+_nlp = None
+_nlp_lock = threading.Lock()
+
+
+# spaCy is slow to import + load, so defer it until the first message (or startup warmup) needs it
+def get_nlp():
+    global _nlp
+    with _nlp_lock:
+        if _nlp is None:
+            import spacy
+            if env.SPACY_MODEL_PATH:
+                # pipeline previously trimmed + serialized by export_model()
+                _nlp = spacy.load(env.SPACY_MODEL_PATH)
+            else:
+                _nlp = spacy.load('en_core_web_sm', exclude=EXCLUDED_PIPES)
+        return _nlp
+
+
+_pool = None
+
+
+# spaCy is cpu-bound and mostly holds the GIL, so parses run in separate processes (NLP_WORKERS) per web worker
+def get_pool():
+    global _pool
+    with _nlp_lock:
+        if _pool is None and env.NLP_WORKERS > 0:
+            # spawn rather than fork - the web process has threads + an event loop that shouldn't be copied
+            _pool = ProcessPoolExecutor(max_workers=env.NLP_WORKERS, mp_context=multiprocessing.get_context('spawn'), initializer=get_nlp)
+        return _pool
+
+
+# load the model in every pool process ahead of the first message
+def warm_pool():
+    pool = get_pool()
+    if pool is None:
+        get_nlp()
+        return
+    for future in [pool.submit(analyze, 'warmup') for _ in range(env.NLP_WORKERS)]:
+        future.result()
+
+
+# write the trimmed pipeline to disk, point SPACY_MODEL_PATH at it to skip the exclusion work on boot
+def export_model(path:str):
+    import spacy
+    spacy.load('en_core_web_sm', exclude=EXCLUDED_PIPES).to_disk(path)
 
 
 class NLPException(Exception):
@@ -18,43 +70,70 @@ class ActionKeywords:
     UPDATE = ['update', 'edit', 'modify', 'change']
 
 
-def extract_park(msg:str) -> Park:
-    parks = CrudUtils.read_parks()
-    res = _extract_best_match(msg, [p.name for p in parks], threshold=30)
+DELETE_INDEX = NameIndex(ActionKeywords.DELETE)
+UPDATE_INDEX = NameIndex(ActionKeywords.UPDATE)
+
+
+# everything the extractors need from one spaCy parse, as plain strings so it's cheap to cache
+class MessageAnalysis(NamedTuple):
+    text: str
+    noun_chunks: Tuple[str, ...]
+    tokens: Tuple[str, ...]
+
+
+# parse once per message - retried webhooks with the same text are served from the cache
+@functools.lru_cache(maxsize=256)
+def analyze(msg:str) -> MessageAnalysis:
+    doc = get_nlp()(msg)
+    return MessageAnalysis(
+        text=msg,
+        noun_chunks=tuple(chunk.text for chunk in doc.noun_chunks),
+        tokens=tuple(token.text for token in doc),
+    )
+
+
+async def analyze_async(msg:str) -> MessageAnalysis:
+    # without a process pool, fall back to the default thread pool - still off the event loop
+    return await asyncio.get_running_loop().run_in_executor(get_pool(), analyze, msg)
+
+
+def extract_park(msg:Union[str, MessageAnalysis]) -> Park:
+    catalog = get_catalog()
+    res = _extract_best_match(msg, catalog.park_index, threshold=30)
     if res is None:
         raise NLPException
     index, _ = res
-    return parks[index]
+    return catalog.parks[index]
 
 
-def extract_ride(msg:str, park_id:int) -> Ride:
-    rides = CrudUtils.read_rides(park_id=park_id)
-    res = _extract_best_match(msg, [r.name for r in rides], threshold=70)
+def extract_ride(msg:Union[str, MessageAnalysis], park_id:int) -> Ride:
+    catalog = get_catalog()
+    res = _extract_best_match(msg, catalog.ride_index(park_id), threshold=70)
     if res is None:
         raise NLPException
     index, _ = res
-    return rides[index]
+    return catalog.rides(park_id)[index]
 
 
-def extract_wait_time(msg:str) -> int:
+def extract_wait_time(msg:Union[str, MessageAnalysis]) -> int:
     # crude regex matching for now
-    matches = re.findall('\d+', msg)
+    matches = re.findall('\d+', _analysis(msg).text)
     if len(matches) > 0:
         wait_time = matches[0]
         return int(wait_time)
 
 
-def detect_deletion_message(msg:str) -> bool:
+def detect_deletion_message(msg:Union[str, MessageAnalysis]) -> bool:
     # temporary bad solution - can we do semantic matching?
-    res = _extract_best_match(msg, ActionKeywords.DELETE, threshold=90, pos_='VERB')
+    res = _extract_best_match(msg, DELETE_INDEX, threshold=90, pos_='VERB')
     if res is None:
         return False
     return True
 
 
-def detect_update_message(msg:str) -> bool:
+def detect_update_message(msg:Union[str, MessageAnalysis]) -> bool:
     # temporary bad solution - can we do semantic matching?
-    res = _extract_best_match(msg, ActionKeywords.UPDATE, threshold=90, pos_='VERB')
+    res = _extract_best_match(msg, UPDATE_INDEX, threshold=90, pos_='VERB')
     if res is None:
         return False
     return True
@@ -63,23 +142,19 @@ def detect_update_message(msg:str) -> bool:
 ### HELPER FUNCTIONS ###
 
 
-def _extract_best_match(msg:str, match_list:List[str], threshold:int=0, pos_:str='NOUN') -> Tuple[int, str]:
-    doc = NLP(msg)
-    closest_match, best_ratio = None, 0
-    chunks = []
+def _analysis(msg:Union[str, MessageAnalysis]) -> MessageAnalysis:
+    if isinstance(msg, MessageAnalysis):
+        return msg
+    return analyze(msg)
+
+
+def _extract_best_match(msg:Union[str, MessageAnalysis], index:NameIndex, threshold:int=0, pos_:str='NOUN') -> Tuple[int, float]:
+    analysis = _analysis(msg)
     pos_ = pos_.upper().strip()
     if pos_ == 'NOUN':
-        chunks = doc.noun_chunks
+        chunks = analysis.noun_chunks
     elif pos_ == 'VERB':
-        chunks = doc
+        chunks = analysis.tokens
     else:
         raise NLPException
-    for chunk in chunks:
-        match, ratio = fuzzymatching.extractOne(chunk.text, match_list)
-        if ratio > best_ratio:
-            closest_match = match
-            best_ratio = ratio
-            if ratio == 100:
-                break
-    if best_ratio > threshold:
-        return match_list.index(closest_match), closest_match
\ No newline at end of file
+    return index.match(chunks, threshold=threshold)
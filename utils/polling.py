@@ -0,0 +1,87 @@
+import threading
+from typing import Dict, Iterable, List
+
+
+# seconds between polls of one park, by state - the update job ticks every minute, so these are minute granular
+WATCHED_VOLATILE_INTERVAL = 60 # active alerts + waits moving
+WATCHED_INTERVAL = 120 # active alerts
+OPEN_VOLATILE_INTERVAL = 300 # no alerts, still sampled for the wait history
+OPEN_INTERVAL = 600
+CLOSED_WATCHED_INTERVAL = 600 # every ride closed, checking for opening
+CLOSED_INTERVAL = 1800
+RETRY_INTERVAL = 60 # after a failed poll, doubled per consecutive failure up to CLOSED_INTERVAL
+VOLATILE = 0.1 # smoothed share of rides changing per poll above which a park counts as volatile
+SMOOTHING = 0.5 # weight of the latest poll in the volatility average
+
+
+class ParkPoll:
+    def __init__(self):
+        self.next_poll = 0.0 # due straight away
+        self.watchers = 0
+        self.is_open = True
+        self.volatility = 1.0 # unknown parks start out volatile
+        self.failures = 0
+
+    def interval(self) -> int:
+        if self.failures > 0:
+            return min(RETRY_INTERVAL * 2 ** (self.failures - 1), CLOSED_INTERVAL)
+        if not self.is_open:
+            return CLOSED_WATCHED_INTERVAL if self.watchers > 0 else CLOSED_INTERVAL
+        volatile = self.volatility >= VOLATILE
+        if self.watchers > 0:
+            return WATCHED_VOLATILE_INTERVAL if volatile else WATCHED_INTERVAL
+        return OPEN_VOLATILE_INTERVAL if volatile else OPEN_INTERVAL
+
+
+# per-park next poll times for update_wait_times, held in the (single, leader) worker process
+class PollScheduler:
+    def __init__(self):
+        self.parks:Dict[int, ParkPoll] = {}
+        self._lock = threading.Lock()
+
+    # parks due at `now`, promoting any that gained alerts since the last tick; forgets parks no longer listed
+    def due(self, park_ids:Iterable[int], watchers:Dict[int, int], now:float) -> List[int]:
+        with self._lock:
+            parks = {park_id:self.parks.get(park_id) or ParkPoll() for park_id in park_ids}
+            self.parks = parks
+            due = []
+            for park_id, poll in parks.items():
+                count = watchers.get(park_id, 0)
+                if count > poll.watchers:
+                    poll.next_poll = now
+                poll.watchers = count
+                if poll.next_poll <= now:
+                    due.append(park_id)
+            return due
+
+    # payload written for a park, called from the db writer threads
+    def observe(self, park_id:int, rides:int, changed:int, is_open:bool):
+        with self._lock:
+            poll = self.parks.setdefault(park_id, ParkPoll())
+            poll.is_open = is_open
+            poll.volatility = (1 - SMOOTHING) * poll.volatility + SMOOTHING * (changed / rides if rides > 0 else 0)
+
+    # after a poll - unchanged payloads (304s, identical bodies) count as calm
+    def reschedule(self, park_id:int, ok:bool, changed:bool, now:float) -> int:
+        with self._lock:
+            poll = self.parks.setdefault(park_id, ParkPoll())
+            if not ok:
+                poll.failures += 1
+            else:
+                poll.failures = 0
+                if not changed:
+                    poll.volatility *= 1 - SMOOTHING
+            interval = poll.interval()
+            poll.next_poll = now + interval
+            return interval
+
+    def stats(self) -> dict:
+        with self._lock:
+            polls = list(self.parks.values())
+        return {
+            'parks': len(polls),
+            'watched': sum(p.watchers > 0 for p in polls),
+            'closed': sum(not p.is_open for p in polls),
+            'volatile': sum(p.volatility >= VOLATILE for p in polls),
+            'failing': sum(p.failures > 0 for p in polls),
+        }
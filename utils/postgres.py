@@ -1,9 +1,17 @@
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+import datetime
+import io
 import logging
 import re
-from typing import List, Type, Union
-from sqlalchemy import create_engine, Column, Boolean, Integer, String, ForeignKey
+import time
+from typing import AsyncIterator, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Type, Union
+from sqlalchemy import bindparam, create_engine, delete, event, func, literal_column, select, text, update, Column, Boolean, Float, Index, Integer, SmallInteger, String, ForeignKey, and_, or_
+from sqlalchemy.dialects.postgresql import insert, ARRAY
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import sessionmaker, relationship, Session
+from . import metrics
 import env
 
 
@@ -12,9 +20,19 @@ logger = logging.getLogger(env.ENV_NAME)
 
 ### DB SETUP ###
 
-url = re.sub('postgres', 'postgresql', env.DATABASE_URL) # workaround for heroku-managed db url
+url = re.sub('^postgres://', 'postgresql://', env.DATABASE_URL) # heroku-managed db urls use the scheme sqlalchemy dropped
 engine = create_engine(url, echo=False)
-SessionLocal = sessionmaker(autocommit=False, bind=engine)
+# objects stay usable after commit, so callers don't need a refresh (an extra SELECT) per row
+SessionLocal = sessionmaker(autocommit=False, bind=engine, expire_on_commit=False)
+# asyncpg engine for the webhook path, so database waits don't block the event loop
+async_engine = create_async_engine(
+    re.sub('^postgresql', 'postgresql+asyncpg', url),
+    pool_size=env.DB_POOL_SIZE,
+    max_overflow=env.DB_POOL_SIZE,
+    pool_pre_ping=True,
+    pool_recycle=1800,
+)
+AsyncSessionLocal = sessionmaker(bind=async_engine, class_=AsyncSession, expire_on_commit=False)
 Base = declarative_base()
 
 
@@ -22,6 +40,7 @@ class Park(Base):
     __tablename__ = 'parks'
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
+    timezone = Column(String, nullable=True)
     rides = relationship("Ride", passive_deletes=True, backref="park")
     alerts = relationship("Alert", passive_deletes=True, backref="park")
     def __repr__(self):
@@ -42,52 +61,458 @@ class Ride(Base):
 class Alert(Base):
     __tablename__ = 'alerts'
     id = Column(String, primary_key=True)
-    ride_id = Column(Integer, ForeignKey("rides.id", ondelete='CASCADE'), nullable=False)
-    park_id = Column(Integer, ForeignKey("parks.id", ondelete='CASCADE'), nullable=False)
+    ride_id = Column(Integer, ForeignKey("rides.id", ondelete='CASCADE'), nullable=False, index=True)
+    park_id = Column(Integer, ForeignKey("parks.id", ondelete='CASCADE'), nullable=False, index=True)
     phone_number = Column(String, nullable=False)
     wait_time = Column(Integer, nullable=False)
-    expiration = Column(Integer, nullable=False)
+    expiration = Column(Integer, nullable=False, index=True)
+    claimed_until = Column(Integer) # set once a close-out pass has claimed it, see CrudUtils.close_alerts
+    __table_args__ = (
+        Index('ix_alerts_phone_number_ride_id', 'phone_number', 'ride_id'),
+        # only alerts a pass has claimed carry it, so the expiry sweep finds them without a scan
+        Index('ix_alerts_claimed_until', 'claimed_until', postgresql_where=text('claimed_until IS NOT NULL')),
+    )
     def __repr__(self):
         return f"[{self.id}] {self.phone_number} ({self.ride_id} @ {self.park_id}) - {self.wait_time} by {self.expiration}"
 
 
-Base.metadata.create_all(bind=engine)
+# append-only wait time samples, range partitioned by day on ts (epoch seconds)
+class RideWait(Base):
+    __tablename__ = 'ride_waits'
+    ride_id = Column(Integer, primary_key=True)
+    ts = Column(Integer, primary_key=True)
+    wait_time = Column(SmallInteger, nullable=False)
+    is_open = Column(Boolean, nullable=False)
+    __table_args__ = {'postgresql_partition_by': 'RANGE (ts)'}
+
+
+# typical wait per ride + park-local day of week (0 = Monday) + hour, precomputed from ride_waits
+class RideWaitRollup(Base):
+    __tablename__ = 'ride_wait_rollups'
+    ride_id = Column(Integer, primary_key=True)
+    day_of_week = Column(SmallInteger, primary_key=True)
+    hour = Column(SmallInteger, primary_key=True)
+    median_wait = Column(Float, nullable=False)
+    samples = Column(Integer, nullable=False)
+
+
+# wait distribution per ride + park-local day of week + hour, as the waits at forecast.QUANTILES
+class RideWaitForecast(Base):
+    __tablename__ = 'ride_wait_forecasts'
+    ride_id = Column(Integer, primary_key=True)
+    day_of_week = Column(SmallInteger, primary_key=True)
+    hour = Column(SmallInteger, primary_key=True)
+    quantiles = Column(ARRAY(SmallInteger), nullable=False)
+    samples = Column(Integer, nullable=False)
+
+
+# next free send slot per sender, see CrudUtils.reserve_send_slot
+class SendSlot(Base):
+    __tablename__ = 'send_slots'
+    key = Column(String, primary_key=True)
+    next_at = Column(Float, nullable=False) # epoch seconds, by the database clock
+
+
+# single row, bumped whenever parks or rides are added, renamed or removed - web workers poll it to know when their
+# in-memory catalog is out of date (see utils/catalog.py)
+class CatalogVersion(Base):
+    __tablename__ = 'catalog_version'
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False)
+
+
+# twilio MessageSids already taken for processing, so webhook retries are dropped across web workers
+class InboundMessage(Base):
+    __tablename__ = 'inbound_messages'
+    sid = Column(String, primary_key=True)
+    received_at = Column(Integer, nullable=False, index=True)
+
+
+# ride whose wait/status was written by CrudUtils.bulk_upsert_rides (old_wait_time is None for new rides)
+class RideChange(NamedTuple):
+    ride_id: int
+    park_id: int
+    old_wait_time: Optional[int]
+    wait_time: int
+    is_open: bool
+
+
+# fulfilled or expired alert, as returned by CrudUtils.close_alerts
+class ClosedAlert(NamedTuple):
+    id: str
+    phone_number: str
+    ride_name: str
+    ride_wait_time: int
+    alert_wait_time: int
+    expired: bool
+
+
+# outcome of CrudUtils.sync_parks, by park id
+class ParkSync(NamedTuple):
+    created: List[int]
+    updated: List[int]
+    removed: List[int]
+    unchanged: int
+    withheld: List[int] # missing from the payload, but too many of them to trust it (see sync_parks)
+
+    @property
+    def changed(self) -> bool:
+        return len(self.created) + len(self.updated) + len(self.removed) > 0
+
+
+# schema setup talks to the database, so it runs at startup rather than on import
+def init_db():
+    Base.metadata.create_all(bind=engine)
+    # create_all skips tables that already exist, so add any indexes introduced since
+    for index in Alert.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
+    # ...and columns
+    with engine.begin() as connection:
+        connection.execute(text('ALTER TABLE parks ADD COLUMN IF NOT EXISTS timezone VARCHAR'))
+        connection.execute(text('ALTER TABLE alerts ADD COLUMN IF NOT EXISTS claimed_until INTEGER'))
+    CrudUtils.create_history_partitions(days=env.HISTORY_PARTITIONS_AHEAD)
+
+
+# session-level postgres advisory lock on a dedicated connection, held for as long as this process runs
+class LeaderLock:
+    def __init__(self, key:int):
+        self.key = key
+        self.connection = None
+
+    def try_acquire(self) -> bool:
+        # autocommit, so the lock's connection doesn't sit idle in a transaction
+        connection = engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+        if connection.execute(text('SELECT pg_try_advisory_lock(:key)'), {'key': self.key}).scalar():
+            self.connection = connection
+            return True
+        connection.close()
+        return False
+
+    # lock dies with its connection, so a broken connection means leadership is gone
+    def is_held(self) -> bool:
+        if self.connection is None:
+            return False
+        try:
+            self.connection.execute(text('SELECT 1'))
+            return True
+        except Exception:
+            return False
+
+    def release(self):
+        if self.connection is not None:
+            self.connection.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': self.key})
+            self.connection.close()
+            self.connection = None
+
+
+### UNIT OF WORK + QUERY COUNTING ###
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self.elapsed = 0.0
+
+
+# every count_queries() block currently open in this context, so nested blocks all see the statements
+_query_counters:ContextVar[Tuple[QueryCounter, ...]] = ContextVar('query_counters', default=())
+_async_session:ContextVar[Optional[AsyncSession]] = ContextVar('async_session', default=None)
+
+
+@event.listens_for(engine, 'before_cursor_execute')
+@event.listens_for(async_engine.sync_engine, 'before_cursor_execute')
+def _start_query(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(engine, 'after_cursor_execute')
+@event.listens_for(async_engine.sync_engine, 'after_cursor_execute')
+def _end_query(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    metrics.DB_STATEMENT_SECONDS.observe(elapsed)
+    for counter in _query_counters.get():
+        counter.count += 1
+        counter.elapsed += elapsed
+
+
+# failed statements never reach after_cursor_execute
+@event.listens_for(engine, 'handle_error')
+@event.listens_for(async_engine.sync_engine, 'handle_error')
+def _fail_query(context):
+    if context.connection is not None and context.connection.info.get('query_start'):
+        context.connection.info['query_start'].pop()
+
+
+# counts + times every statement issued (sync or async) within the block, including in threads it hands work to
+@contextmanager
+def count_queries() -> Iterator[QueryCounter]:
+    counter = QueryCounter()
+    token = _query_counters.set(_query_counters.get() + (counter,))
+    try:
+        yield counter
+    finally:
+        _query_counters.reset(token)
 
 
 ### DB WRAPPERS ###
 
 
+CLAIM_LEASE = 600 # seconds an alert stays claimed if its close-out pass dies before finishing
+
+
 class CrudUtils:
-    def _create_objects(objs:List[Union[Park, Ride, Alert]]) -> List[Union[Park, Ride, Alert]]:
+    # one short-lived session + transaction per call - calls that must commit together do it in one method
+    # (sync_parks, close_alerts, ...), as the worker hands work to threads a context-bound session would leak into
+    @contextmanager
+    def _scope() -> Iterator[Session]:
         with SessionLocal() as db:
-            for obj in objs:
-                db.add(obj)
+            yield db
             db.commit()
-            for obj in objs:
-                db.refresh(obj)
+
+    def _create_objects(objs:List[Union[Park, Ride, Alert]], refresh:bool=False) -> List[Union[Park, Ride, Alert]]:
+        with CrudUtils._scope() as db:
+            db.add_all(objs)
+            if refresh:
+                db.flush()
+                for obj in objs:
+                    db.refresh(obj)
         return objs
 
-    def create_park(**kwargs) -> Park:
+    def create_park(refresh:bool=False, **kwargs) -> Park:
         return CrudUtils._create_objects([
             Park(**kwargs),
-        ])
+        ], refresh=refresh)
 
-    def create_ride(**kwargs) -> Ride:
+    def create_ride(refresh:bool=False, **kwargs) -> Ride:
         return CrudUtils._create_objects([
             Ride(**kwargs),
-        ])
+        ], refresh=refresh)
 
-    def create_alert(**kwargs) -> Alert:
+    def create_alert(refresh:bool=False, **kwargs) -> Alert:
         return CrudUtils._create_objects([
             Alert(**kwargs),
+        ], refresh=refresh)
+
+    def bulk_upsert_rides(park_id:int, rides:List[dict]) -> List[RideChange]:
+        # one INSERT ... ON CONFLICT per park, skipping rows whose wait/status didn't change
+        if len(rides) == 0:
+            return []
+        # pre-update waits of the incoming rides - every part of the statement reads the same snapshot
+        previous = select(Ride.id, Ride.wait_time).where(Ride.id.in_([r['id'] for r in rides])).cte('previous')
+        stmt = insert(Ride).values([
+            {
+                'id': r['id'],
+                'name': str(r['name']).strip(),
+                'park_id': park_id,
+                'wait_time': r['wait_time'],
+                'is_open': r['is_open'],
+            } for r in rides
         ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Ride.id],
+            set_={
+                'wait_time': stmt.excluded.wait_time,
+                'is_open': stmt.excluded.is_open,
+            },
+            where=or_(
+                Ride.wait_time != stmt.excluded.wait_time,
+                Ride.is_open != stmt.excluded.is_open,
+            ),
+        ).returning(
+            Ride.id,
+            Ride.wait_time,
+            Ride.is_open,
+            # NULL for new rides; the literal keeps sqlalchemy from adding (and self-joining) rides in the subquery
+            select(previous.c.wait_time).where(previous.c.id == literal_column('rides.id')).scalar_subquery().label('old_wait_time'),
+        ).add_cte(previous)
+        with CrudUtils._scope() as db:
+            rows = db.execute(stmt).fetchall()
+            if any(row.old_wait_time is None for row in rows):
+                CrudUtils._bump_catalog_version(db)
+        return [RideChange(row.id, park_id, row.old_wait_time, row.wait_time, row.is_open) for row in rows]
+
+    def sync_parks(parks:List[dict], max_removed_share:float=1.0) -> ParkSync:
+        # diff the payload ({id, name, timezone} dicts) against the table in memory, then one bulk statement per kind of change
+        with CrudUtils._scope() as db:
+            current = {row.id:(row.name, row.timezone) for row in db.execute(select(Park.id, Park.name, Park.timezone).with_for_update())}
+            incoming = {p['id']:(p['name'], p.get('timezone')) for p in parks}
+            created = [id for id in incoming if id not in current]
+            updated = [id for id in incoming if id in current and incoming[id] != current[id]]
+            removed = [id for id in current if id not in incoming]
+            # an empty or truncated payload would otherwise wipe parks, along with their rides + alerts
+            withheld = []
+            if len(removed) > len(current) * max_removed_share:
+                removed, withheld = [], removed
+            if len(created) > 0:
+                db.execute(insert(Park), [{'id': id, 'name': incoming[id][0], 'timezone': incoming[id][1]} for id in created])
+            if len(updated) > 0:
+                table = Park.__table__
+                stmt = update(table).where(table.c.id == bindparam('park_id')).values(name=bindparam('park_name'), timezone=bindparam('park_timezone'))
+                db.execute(stmt, [{'park_id': id, 'park_name': incoming[id][0], 'park_timezone': incoming[id][1]} for id in updated])
+            if len(removed) > 0:
+                # rides + alerts go with them (ON DELETE CASCADE)
+                db.execute(delete(Park).where(Park.id.in_(removed)))
+            if len(created) + len(updated) + len(removed) > 0:
+                CrudUtils._bump_catalog_version(db)
+        return ParkSync(created, updated, removed, len(incoming) - len(created) - len(updated), withheld)
+
+    # in the same transaction as the change, so a reader never sees the new version without the new rows
+    def _bump_catalog_version(db:Session):
+        stmt = insert(CatalogVersion).values(id=1, version=1)
+        db.execute(stmt.on_conflict_do_update(index_elements=[CatalogVersion.id], set_={'version': CatalogVersion.version + 1}))
+
+    def read_catalog_version() -> int:
+        with CrudUtils._scope() as db:
+            return db.execute(select(CatalogVersion.version).where(CatalogVersion.id == 1)).scalar() or 0
+
+    # active alerts per park, for the poll scheduler
+    def count_alerts_by_park() -> Dict[int, int]:
+        with CrudUtils._scope() as db:
+            return dict(db.execute(select(Alert.park_id, func.count()).group_by(Alert.park_id)).all())
+
+    def read_alerts_in_parks(park_ids:List[int]) -> List[Alert]:
+        with CrudUtils._scope() as db:
+            return db.execute(select(Alert).where(Alert.park_id.in_(park_ids))).scalars().all()
+
+    def close_alerts(now:int, notify:Callable[[List[ClosedAlert]], Iterable[str]], alert_ids:List[str]=None, include_fulfilled:bool=True) -> List[ClosedAlert]:
+        # find every fulfilled or expired alert in one indexed join, and claim them so concurrent passes skip them
+        # conditions are re-checked here, so callers may pass candidate ids from a stale snapshot
+        expired = Alert.expiration <= now
+        fulfilled = Ride.wait_time <= Alert.wait_time
+        if include_fulfilled:
+            condition = or_(fulfilled, expired)
+        else:
+            # expired, or fulfilled but left behind by an earlier pass (released, or its worker died mid-send) -
+            # both sides of the first clause are indexed on alerts, so the rest of the table is never read
+            condition = and_(or_(expired, Alert.claimed_until.isnot(None)), or_(expired, fulfilled))
+        candidates = select(Alert.id).join(Ride, Alert.ride_id == Ride.id).where(
+            condition,
+            or_(Alert.claimed_until.is_(None), Alert.claimed_until < now),
+        )
+        if alert_ids is not None:
+            candidates = candidates.where(Alert.id.in_(alert_ids))
+        # core tables - the orm can't return another table's columns from an UPDATE ... FROM
+        alerts, rides = Alert.__table__, Ride.__table__
+        claim = update(alerts).where(
+            alerts.c.ride_id == rides.c.id,
+            alerts.c.id.in_(candidates.with_for_update(of=Alert, skip_locked=True).scalar_subquery()),
+        ).values(claimed_until=now + CLAIM_LEASE).returning(
+            alerts.c.id,
+            alerts.c.phone_number,
+            rides.c.name.label('ride_name'),
+            rides.c.wait_time.label('ride_wait_time'),
+            alerts.c.wait_time.label('alert_wait_time'),
+            alerts.c.expiration,
+        )
+        # claim, send and delete in separate short transactions, so no row lock is held while messages go out
+        # (a webhook editing one of these alerts would otherwise wait on the sms rate limit)
+        with SessionLocal.begin() as db:
+            claimed = [
+                ClosedAlert(row.id, row.phone_number, row.ride_name, row.ride_wait_time, row.alert_wait_time, row.expiration <= now)
+                for row in db.execute(claim)
+            ]
+        if len(claimed) == 0:
+            return []
+        # only delete alerts whose notification was settled (acknowledged, or rejected for good), the rest are released -
+        # their lease ends now, but claimed_until stays set so the next sweep retries them
+        acknowledged = set(notify(claimed))
+        closed = [c for c in claimed if c.id in acknowledged]
+        with SessionLocal.begin() as db:
+            if len(closed) > 0:
+                db.execute(delete(Alert).where(Alert.id.in_([c.id for c in closed])).execution_options(synchronize_session=False))
+            if len(closed) < len(claimed):
+                released = [c.id for c in claimed if c.id not in acknowledged]
+                db.execute(update(Alert).where(Alert.id.in_(released)).values(claimed_until=now).execution_options(synchronize_session=False))
+        return closed
+
+    def copy_ride_waits(rows:List[tuple]) -> int:
+        # (ride_id, ts, wait_time, is_open) rows, streamed in with one COPY instead of row-by-row inserts
+        if len(rows) == 0:
+            return 0
+        buffer = io.StringIO()
+        for ride_id, ts, wait_time, is_open in rows:
+            buffer.write(f"{ride_id},{ts},{wait_time},{'t' if is_open else 'f'}\n")
+        buffer.seek(0)
+        connection = engine.raw_connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.copy_expert('COPY ride_waits (ride_id, ts, wait_time, is_open) FROM STDIN WITH (FORMAT csv)', buffer)
+            connection.commit()
+        finally:
+            connection.close()
+        return len(rows)
+
+    def export_ride_waits(start:int, end:int) -> io.StringIO:
+        # csv of open samples in [start, end), straight out of COPY so pandas can parse it in bulk
+        buffer = io.StringIO()
+        connection = engine.raw_connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.copy_expert(
+                    f"COPY (SELECT ride_id, ts, wait_time FROM ride_waits WHERE is_open AND ts >= {int(start)} AND ts < {int(end)}) TO STDOUT WITH (FORMAT csv, HEADER)",
+                    buffer,
+                )
+        finally:
+            connection.close()
+        buffer.seek(0)
+        return buffer
+
+    # one partition per utc day, created ahead of time so COPY never lands outside a partition
+    def create_history_partitions(days:int, start:datetime.date=None) -> List[str]:
+        start = start or datetime.datetime.utcnow().date()
+        created = []
+        with engine.begin() as connection:
+            for offset in range(days + 1):
+                day = start + datetime.timedelta(days=offset)
+                lower = int(datetime.datetime(day.year, day.month, day.day, tzinfo=datetime.timezone.utc).timestamp())
+                name = f"ride_waits_{day:%Y%m%d}"
+                connection.execute(text(
+                    f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF ride_waits FOR VALUES FROM ({lower}) TO ({lower + 86400})"
+                ))
+                created.append(name)
+        return created
+
+    # retention - dropping a whole partition is instant, unlike DELETE + vacuum
+    def drop_history_partitions(before:datetime.date) -> List[str]:
+        with engine.begin() as connection:
+            partitions = connection.execute(text(
+                "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = 'ride_waits'"
+            )).scalars().all()
+            dropped = [name for name in partitions if name < f"ride_waits_{before:%Y%m%d}"]
+            for name in dropped:
+                connection.execute(text(f"DROP TABLE IF EXISTS {name}"))
+        return dropped
+
+    def replace_rollups(rows:List[dict]) -> int:
+        with CrudUtils._scope() as db:
+            db.execute(delete(RideWaitRollup))
+            if len(rows) > 0:
+                db.execute(insert(RideWaitRollup), rows)
+        return len(rows)
+
+    def read_rollup(ride_id:int, day_of_week:int, hour:int) -> Optional[RideWaitRollup]:
+        with CrudUtils._scope() as db:
+            return db.get(RideWaitRollup, (ride_id, day_of_week, hour))
+
+    def replace_forecasts(rows:List[dict]) -> int:
+        with CrudUtils._scope() as db:
+            db.execute(delete(RideWaitForecast))
+            if len(rows) > 0:
+                db.execute(insert(RideWaitForecast), rows)
+        return len(rows)
+
+    def read_forecasts(ride_id:int) -> List[RideWaitForecast]:
+        with CrudUtils._scope() as db:
+            return db.query(RideWaitForecast).filter(RideWaitForecast.ride_id == ride_id).all()
+
+    def read_ride_timezones() -> dict[int:str]:
+        with CrudUtils._scope() as db:
+            return dict(db.execute(select(Ride.id, Park.timezone).join(Park, Ride.park_id == Park.id)).all())
 
     def _read_objects(ctype:Type[Union[Park, Ride, Alert]], filters:dict[str:str]) -> List[Union[Park, Ride, Alert]]:
-        with SessionLocal() as db:
-            q = db.query(ctype)
-            for k,v in filters.items():
-                q.filter(ctype.__dict__[k] == v)
-            return q.all()
+        with CrudUtils._scope() as db:
+            return db.query(ctype).filter_by(**filters).all()
 
     def read_parks(**kwargs) -> List[Park]:
         return CrudUtils._read_objects(Park, kwargs)
@@ -98,39 +523,33 @@ class CrudUtils:
     def read_alerts(**kwargs) -> List[Alert]:
         return CrudUtils._read_objects(Alert, kwargs)
 
-    def _update_objects(ctype:Type[Union[Park, Ride, Alert]], filters:dict[str:str], updates:dict[str:str]) -> List[Union[Park, Ride, Alert]]:
+    def _update_objects(ctype:Type[Union[Park, Ride, Alert]], filters:dict[str:str], updates:dict[str:str], refresh:bool=False) -> List[Union[Park, Ride, Alert]]:
         logger.debug(filters)
-        with SessionLocal() as db:
-            q = db.query(ctype)
-            for k,v in filters.items():
-                q = q.with_transformation(lambda q:q.filter(ctype.__dict__[k] == v))
-            objs = q.with_transformation(lambda q:q.all())
+        with CrudUtils._scope() as db:
+            objs = db.query(ctype).filter_by(**filters).all()
             for obj in objs:
                 for k,v in updates.items():
                     setattr(obj, k, v)
-            db.commit()
-            for obj in objs:
-                db.refresh(obj)
+            if refresh:
+                db.flush()
+                for obj in objs:
+                    db.refresh(obj)
         return objs
 
-    def update_parks(updates:dict[str:str]={}, **kwargs) -> Park:
-        return CrudUtils._update_objects(Park, filters=kwargs, updates=updates)[0]
+    def update_parks(updates:dict[str:str]={}, refresh:bool=False, **kwargs) -> Park:
+        return CrudUtils._update_objects(Park, filters=kwargs, updates=updates, refresh=refresh)[0]
 
-    def update_rides(updates:dict[str:str]={}, **kwargs) -> Ride:
-        return CrudUtils._update_objects(Ride, filters=kwargs, updates=updates)[0]
+    def update_rides(updates:dict[str:str]={}, refresh:bool=False, **kwargs) -> Ride:
+        return CrudUtils._update_objects(Ride, filters=kwargs, updates=updates, refresh=refresh)[0]
 
-    def update_alerts(updates:dict[str:str]={}, **kwargs) -> Alert:
-        return CrudUtils._update_objects(Alert, filters=kwargs, updates=updates)[0]
+    def update_alerts(updates:dict[str:str]={}, refresh:bool=False, **kwargs) -> Alert:
+        return CrudUtils._update_objects(Alert, filters=kwargs, updates=updates, refresh=refresh)[0]
 
     def _delete_objects(ctype:Type[Union[Park, Ride, Alert]], filters:dict[str:str]) -> List[Union[Park, Ride, Alert]]:
-        with SessionLocal() as db:
-            q = db.query(ctype)
-            for k,v in filters.items():
-                q.with_transformation(lambda q:q.filter(ctype.__dict__[k] == v))
-            objs = q.with_transformation(lambda q:q.all())
+        with CrudUtils._scope() as db:
+            objs = db.query(ctype).filter_by(**filters).all()
             for obj in objs:
                 db.delete(obj)
-            db.commit()
         return objs
 
     def delete_parks(**kwargs) -> List[Union[Park, Ride, Alert]]:
@@ -140,4 +559,99 @@ class CrudUtils:
         return CrudUtils._delete_objects(Ride, filters=kwargs)
 
     def delete_alerts(**kwargs) -> List[Union[Park, Ride, Alert]]:
-        return CrudUtils._delete_objects(Alert, filters=kwargs)
\ No newline at end of file
+        return CrudUtils._delete_objects(Alert, filters=kwargs)
+
+    # reserves the sender's next slot across every process, returns how long to wait for it
+    def reserve_send_slot(key:str, interval:float) -> float:
+        now = func.extract('epoch', func.clock_timestamp())
+        stmt = insert(SendSlot).values(key=key, next_at=now + interval)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[SendSlot.key],
+            set_={'next_at': func.greatest(SendSlot.next_at, now) + interval},
+        ).returning((SendSlot.next_at - interval - now).label('wait'))
+        # its own short transaction, so the slot row is never locked for longer than this statement
+        with SessionLocal.begin() as db:
+            return float(db.execute(stmt).scalar())
+
+    def prune_inbound_messages(before:int) -> int:
+        with CrudUtils._scope() as db:
+            return db.execute(delete(InboundMessage).where(InboundMessage.received_at < before)).rowcount
+
+
+# asyncio twin of CrudUtils for the alert operations on the webhook path
+class AsyncCrudUtils:
+    # one session + transaction for a whole webhook request
+    @asynccontextmanager
+    async def unit_of_work() -> AsyncIterator[AsyncSession]:
+        if _async_session.get() is not None:
+            yield _async_session.get()
+            return
+        async with AsyncSessionLocal() as db:
+            token = _async_session.set(db)
+            try:
+                yield db
+                await db.commit()
+            except Exception:
+                await db.rollback()
+                raise
+            finally:
+                _async_session.reset(token)
+
+    @asynccontextmanager
+    async def _scope() -> AsyncIterator[AsyncSession]:
+        db = _async_session.get()
+        if db is not None:
+            yield db
+            await db.flush()
+            return
+        async with AsyncSessionLocal() as db:
+            yield db
+            await db.commit()
+
+    async def _create_objects(objs:List[Union[Park, Ride, Alert]]) -> List[Union[Park, Ride, Alert]]:
+        async with AsyncCrudUtils._scope() as db:
+            db.add_all(objs)
+        return objs
+
+    async def create_alert(**kwargs) -> Alert:
+        return await AsyncCrudUtils._create_objects([
+            Alert(**kwargs),
+        ])
+
+    async def _read_objects(ctype:Type[Union[Park, Ride, Alert]], filters:dict[str:str]) -> List[Union[Park, Ride, Alert]]:
+        async with AsyncCrudUtils._scope() as db:
+            return (await db.execute(select(ctype).filter_by(**filters))).scalars().all()
+
+    async def read_ride(id:int) -> Optional[Ride]:
+        async with AsyncCrudUtils._scope() as db:
+            return await db.get(Ride, id)
+
+    async def read_alerts(**kwargs) -> List[Alert]:
+        return await AsyncCrudUtils._read_objects(Alert, kwargs)
+
+    async def _update_objects(ctype:Type[Union[Park, Ride, Alert]], filters:dict[str:str], updates:dict[str:str]) -> List[Union[Park, Ride, Alert]]:
+        async with AsyncCrudUtils._scope() as db:
+            objs = (await db.execute(select(ctype).filter_by(**filters))).scalars().all()
+            for obj in objs:
+                for k,v in updates.items():
+                    setattr(obj, k, v)
+        return objs
+
+    async def update_alerts(updates:dict[str:str]={}, **kwargs) -> Alert:
+        return (await AsyncCrudUtils._update_objects(Alert, filters=kwargs, updates=updates))[0]
+
+    async def _delete_objects(ctype:Type[Union[Park, Ride, Alert]], filters:dict[str:str]) -> List[Union[Park, Ride, Alert]]:
+        async with AsyncCrudUtils._scope() as db:
+            objs = (await db.execute(select(ctype).filter_by(**filters))).scalars().all()
+            for obj in objs:
+                await db.delete(obj)
+        return objs
+
+    async def delete_alerts(**kwargs) -> List[Union[Park, Ride, Alert]]:
+        return await AsyncCrudUtils._delete_objects(Alert, filters=kwargs)
+
+    # true for the first caller with this sid, false for every retry after it
+    async def claim_inbound_message(sid:str, now:int) -> bool:
+        stmt = insert(InboundMessage).values(sid=sid, received_at=now).on_conflict_do_nothing().returning(InboundMessage.sid)
+        async with AsyncCrudUtils._scope() as db:
+            return (await db.execute(stmt)).first() is not None
@@ -0,0 +1,113 @@
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import time
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional
+import httpx
+from . import metrics
+import env
+
+
+logger = logging.getLogger('uvicorn')
+
+
+TIMEOUT = httpx.Timeout(10.0, connect=5.0)
+RETRIES = 3
+BACKOFF = 0.5 # seconds, doubled on every retry
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class QueueTimesException(Exception):
+    pass
+
+
+class FetchResult(NamedTuple):
+    park_id: int
+    elapsed: float
+    ok: bool
+    changed: bool = False
+
+
+# validators + content hash of the last payload written for each park
+class ParkState(NamedTuple):
+    etag: Optional[str]
+    last_modified: Optional[str]
+    digest: str
+
+
+PARK_STATE:Dict[int, ParkState] = {}
+CACHE_STATS = {'not_modified': 0, 'unchanged': 0, 'changed': 0}
+
+
+def cache_stats() -> dict:
+    return dict(CACHE_STATS)
+
+
+# fetch every park's queue_times.json through one pooled client, writing each result as soon as it lands
+async def fetch_wait_times(park_ids:Iterable[int], handler:Callable[[int, dict], None], concurrency:int=env.MAX_THREADS, base_url:str=env.QUEUE_TIMES_URL) -> List[FetchResult]:
+    # semaphore gives a sliding window - a new park starts as soon as any other finishes
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=TIMEOUT, limits=limits) as client:
+        tasks = [_fetch_park(client, semaphore, park_id, handler) for park_id in park_ids]
+        return await asyncio.gather(*tasks)
+
+
+async def _fetch_park(client:httpx.AsyncClient, semaphore:asyncio.Semaphore, park_id:int, handler:Callable[[int, dict], None]) -> FetchResult:
+    async with semaphore:
+        start = time.perf_counter()
+        state = PARK_STATE.get(park_id)
+        try:
+            response = await _get_with_retries(client, f"/parks/{park_id}/queue_times.json", headers=_conditional_headers(state))
+            metrics.FETCH_SECONDS.observe(time.perf_counter() - start, park_id=park_id)
+            # upstream says nothing changed - skip the body entirely
+            if response.status_code == 304:
+                CACHE_STATS['not_modified'] += 1
+                metrics.FETCH_RESULTS.inc(outcome='not_modified')
+                return FetchResult(park_id, time.perf_counter() - start, True, False)
+            # upstream sent a body anyway, but it's byte-for-byte what we last wrote
+            digest = hashlib.sha256(response.content).hexdigest()
+            if state is not None and state.digest == digest:
+                CACHE_STATS['unchanged'] += 1
+                metrics.FETCH_RESULTS.inc(outcome='unchanged')
+                return FetchResult(park_id, time.perf_counter() - start, True, False)
+            CACHE_STATS['changed'] += 1
+            metrics.FETCH_RESULTS.inc(outcome='changed')
+            # db writer is blocking, keep it off the event loop
+            await asyncio.to_thread(handler, park_id, json.loads(response.content))
+            # only remember this payload once it's safely written, so a failed write retries next cycle
+            PARK_STATE[park_id] = ParkState(response.headers.get('ETag'), response.headers.get('Last-Modified'), digest)
+        except Exception as e:
+            logger.warning(f"Failed to refresh wait times for park {park_id}: {e!r}")
+            metrics.FETCH_RESULTS.inc(outcome='failed')
+            return FetchResult(park_id, time.perf_counter() - start, False)
+        return FetchResult(park_id, time.perf_counter() - start, True, True)
+
+
+def _conditional_headers(state:Optional[ParkState]) -> dict:
+    headers = {}
+    if state is not None and state.etag is not None:
+        headers['If-None-Match'] = state.etag
+    if state is not None and state.last_modified is not None:
+        headers['If-Modified-Since'] = state.last_modified
+    return headers
+
+
+async def _get_with_retries(client:httpx.AsyncClient, path:str, headers:Optional[dict]=None) -> httpx.Response:
+    for attempt in range(RETRIES + 1):
+        try:
+            response = await client.get(path, headers=headers)
+            if response.status_code == 304:
+                return response
+            if response.status_code not in RETRY_STATUS_CODES:
+                response.raise_for_status()
+                return response
+            error = QueueTimesException(f"{path} returned {response.status_code}")
+        except httpx.TransportError as e:
+            error = e
+        if attempt < RETRIES:
+            # exponential backoff with jitter so retries don't arrive in lock-step
+            await asyncio.sleep(BACKOFF * 2 ** attempt * (1 + random.random()))
+    raise error
@@ -1,13 +1,27 @@
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+import contextvars
+import functools
+import hashlib
+import logging
+import threading
 import time
 from typing import List
+import uuid
 from fastapi import Response
 import phonenumbers as pn
+from twilio.base.exceptions import TwilioRestException
 from twilio.rest import Client
 from twilio.twiml.messaging_response import MessagingResponse
-from . import nlp, logic
+from . import forecast, nlp, logic, metrics
+from .postgres import AsyncCrudUtils, ClosedAlert, CrudUtils
 import env
 
 
+logger = logging.getLogger('uvicorn')
+
+
 def create_reply_twiml(messages:List[str], status_code:int=200) -> str:
     response = MessagingResponse()
     for msg in messages:
@@ -19,54 +33,228 @@ def create_reply_twiml(messages:List[str], status_code:int=200) -> str:
     )
 
 
-def send_alert_sms(recipient:str, ride_name:str, wait_time:int, expired:bool=False) -> None:
-    if expired:
-        msg = f"Your alert for {ride_name} has expired! The line did not get shorter than {wait_time} minutes."
+# one or more closed alerts for a single recipient, combined into as few messages as the segment budget allows
+def send_alert_sms(recipient:str, alerts:List[ClosedAlert]) -> List[Future]:
+    # same alerts -> same keys, so a part delivered on an earlier pass isn't sent again when the rest are retried
+    key = hashlib.sha256(','.join(sorted(a.id for a in alerts)).encode()).hexdigest()
+    return [get_outbox().submit(recipient, msg, key=f"{key}:{i}") for i, msg in enumerate(alert_messages(alerts))]
+
+
+def alert_messages(alerts:List[ClosedAlert]) -> List[str]:
+    if len(alerts) == 1:
+        alert = alerts[0]
+        if alert.expired:
+            return [f"Your alert for {alert.ride_name} has expired! The line did not get shorter than {alert.alert_wait_time} minutes."]
+        return [f"The line for {alert.ride_name.strip()} is currently {alert.ride_wait_time} minutes! This alert is no longer active."]
+    # pack whole lines, starting a new message rather than splitting a line across two
+    messages = [[]]
+    for alert in alerts:
+        if alert.expired:
+            line = f"- {alert.ride_name.strip()}: expired, never under {alert.alert_wait_time} min"
+        else:
+            line = f"- {alert.ride_name.strip()}: line is {alert.ride_wait_time} min now"
+        if len(messages[-1]) > 0 and sms_segments('\n'.join([DIGEST_HEADER] + messages[-1] + [line])) > MAX_SEGMENTS:
+            messages.append([])
+        messages[-1].append(line)
+    return ['\n'.join([DIGEST_HEADER] + lines) for lines in messages]
+
+
+DIGEST_HEADER = 'These alerts are no longer active:'
+MAX_SEGMENTS = 3 # per message - twilio bills each segment, so this only caps how long one message gets
+GSM_7 = set("@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà")
+GSM_7_EXTENDED = set('^{}\\[~]|€') # two septets each
+
+
+# billable segments: 160 gsm-7 characters (153 once split), or 70 (67) if anything needs ucs-2
+def sms_segments(msg:str) -> int:
+    if all(c in GSM_7 or c in GSM_7_EXTENDED for c in msg):
+        length, single, multi = len(msg) + sum(c in GSM_7_EXTENDED for c in msg), 160, 153
     else:
-        msg = f"The line for {ride_name.strip()} is currently {wait_time} minutes! This alert is no longer active."
-    _send_sms(recipient, msg)
-
-
-def _send_sms(recipient:str, msg:str) -> None:
-    client = Client(env.TWILIO_ACCOUNT_SID, env.TWILIO_AUTH_TOKEN)
-    client.messages.create(
-        body=msg,
-        from_= pn.format_number(
-            pn.parse(env.TWILIO_PHONE_NUMBER, "US"),
-            pn.PhoneNumberFormat.E164
-        ),
-        to= pn.format_number(
-            pn.parse(recipient, "US"),
-            pn.PhoneNumberFormat.E164
-        ),
-    )
+        # characters outside the basic plane take two ucs-2 units
+        length, single, multi = sum(2 if ord(c) > 0xFFFF else 1 for c in msg), 70, 67
+    return 1 if length <= single else -(-length // multi)
+
+
+### OUTBOUND QUEUE ###
+
+
+@functools.lru_cache(maxsize=4096)
+def _e164(number:str) -> str:
+    return pn.format_number(pn.parse(number, "US"), pn.PhoneNumberFormat.E164)
+
+
+# real sends - one client (and so one pooled http session) for the life of the process
+class TwilioTransport:
+    def __init__(self):
+        self.client = Client(env.TWILIO_ACCOUNT_SID, env.TWILIO_AUTH_TOKEN)
+        self.sender = _e164(env.TWILIO_PHONE_NUMBER)
+
+    def send(self, recipient:str, msg:str) -> str:
+        return self.client.messages.create(body=msg, from_=self.sender, to=_e164(recipient)).sid
+
+
+# records messages instead of sending them, for local runs + benchmarks
+class StubTransport:
+    def __init__(self, latency:float=0):
+        self.latency = latency
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def send(self, recipient:str, msg:str) -> str:
+        time.sleep(self.latency)
+        with self._lock:
+            self.sent.append((_e164(recipient), msg))
+            return f"SM{len(self.sent):032d}"
+
+
+# blocking token bucket for one process - fine for the stub transport, real sends use SharedRateLimit
+class TokenBucket:
+    def __init__(self, rate:float, capacity:int=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
 
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# send slots handed out by postgres, so every web + worker process together stays under the sender's throughput
+class SharedRateLimit:
+    def __init__(self, rate:float, key:str):
+        self.interval = 1 / rate
+        self.key = key
+
+    def acquire(self):
+        wait = CrudUtils.reserve_send_slot(self.key, self.interval)
+        if wait > 0:
+            time.sleep(wait)
+
+
+# delivery outcomes - a rejected message (bad number, opted out, ...) will never go through, a failed one might later
+SENT, REJECTED, FAILED = 'sent', 'rejected', 'failed'
+
+
+class Outbox:
+    def __init__(self, transport, workers:int=env.SMS_WORKERS, rate:float=env.SMS_RATE, retries:int=3, backoff:float=1.0, shared:bool=False):
+        self.transport = transport
+        self.bucket = SharedRateLimit(rate, key=env.TWILIO_PHONE_NUMBER or 'default') if shared else TokenBucket(rate)
+        self.retries = retries
+        self.backoff = backoff
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sms')
+        # idempotency keys of delivered messages -> message sid, so a retried send never goes out twice
+        self._delivered = OrderedDict()
+        self._lock = threading.Lock()
+
+    # queue a message, resolving to its delivery outcome - the send runs in the caller's context,
+    # so it counts towards the job (or message) that queued it
+    def submit(self, recipient:str, msg:str, key:str=None) -> Future:
+        return self._executor.submit(contextvars.copy_context().run, self._deliver, recipient, msg, key or str(uuid.uuid4()))
+
+    def _deliver(self, recipient:str, msg:str, key:str) -> str:
+        for attempt in range(self.retries + 1):
+            with self._lock:
+                if key in self._delivered:
+                    metrics.SMS_RESULTS.inc(outcome='duplicate')
+                    return SENT
+            try:
+                self.bucket.acquire()
+                with metrics.SMS_SEND_SECONDS.time():
+                    sid = self.transport.send(recipient, msg)
+            except TwilioRestException as e:
+                # 4xx other than rate limiting won't get better by retrying (bad number, opted out, ...)
+                if e.status != 429 and e.status < 500:
+                    logger.warning(f"SMS to {recipient} rejected: {e.msg}")
+                    metrics.SMS_RESULTS.inc(outcome=REJECTED)
+                    return REJECTED
+                error = e
+            except Exception as e:
+                error = e
+            else:
+                with self._lock:
+                    self._delivered[key] = sid
+                    while len(self._delivered) > 10000:
+                        self._delivered.popitem(last=False)
+                metrics.SMS_RESULTS.inc(outcome=SENT)
+                return SENT
+            if attempt < self.retries:
+                time.sleep(self.backoff * 2 ** attempt)
+        logger.warning(f"SMS to {recipient} failed after {self.retries + 1} attempts: {error!r}")
+        metrics.SMS_RESULTS.inc(outcome=FAILED)
+        return FAILED
+
+
+_outbox = None
+_outbox_lock = threading.Lock()
+
+
+def get_outbox() -> Outbox:
+    global _outbox
+    with _outbox_lock:
+        if _outbox is None:
+            if env.SMS_TRANSPORT == 'stub':
+                _outbox = Outbox(StubTransport())
+            else:
+                _outbox = Outbox(TwilioTransport(), shared=True)
+        return _outbox
+
+
+def set_transport(transport) -> Outbox:
+    global _outbox
+    with _outbox_lock:
+        _outbox = Outbox(transport)
+        return _outbox
+
+
+async def process_message(msg:str, phone_number:str) -> str:
+    # one spaCy parse, shared by every extractor below - runs in the nlp worker pool, off the event loop
+    with metrics.NLP_SECONDS.time(stage='parse'):
+        analysis = await nlp.analyze_async(msg)
 
-def process_message(msg:str, phone_number:str) -> str:
     # fail if fuzzy matching can't detect park name
     try:
-        park = nlp.extract_park(msg)
+        with metrics.NLP_SECONDS.time(stage='park'):
+            park = await asyncio.to_thread(nlp.extract_park, analysis)
     except nlp.NLPException:
         return "Sorry, I'm not sure what park you're visting. Try rephrasing your message."
 
     # fail if fuzzy matching can't detect ride name
     try:
-        ride = nlp.extract_ride(msg, park.id)
+        with metrics.NLP_SECONDS.time(stage='ride'):
+            ride = await asyncio.to_thread(nlp.extract_ride, analysis, park.id)
     except nlp.NLPException:
         return f"Sorry, I'm not sure which ride at {park.name} you're asking about. Try rephrasing your message."
 
     # TODO: make this actually work as intended
-    wait_time = nlp.extract_wait_time(msg)
-    expiration = int(time.time()) + 7200 # default of 2 hours
+    wait_time = nlp.extract_wait_time(analysis)
 
-    # use extracted data to do something in the database
-    if nlp.detect_deletion_message(msg):
-        reply = logic.alert_deletion_flow(ride=ride, phone_number=phone_number)
+    # use extracted data to do something in the database, in a single session + transaction
+    async with AsyncCrudUtils.unit_of_work():
+        if nlp.detect_deletion_message(analysis):
+            return await logic.alert_deletion_flow(ride=ride, phone_number=phone_number)
 
-    elif nlp.detect_update_message(msg):
-        reply = logic.alert_update_flow(ride=ride, phone_number=phone_number, wait_time=wait_time, expiration=expiration)
+        # the catalog can be minutes old, so take the current wait + status from the row itself
+        ride = await AsyncCrudUtils.read_ride(ride.id)
+        if ride is None:
+            return f"Sorry, {park.name} no longer reports wait times for that ride."
 
-    else:
-        reply = logic.alert_creation_flow(ride=ride, park=park, phone_number=phone_number, wait_time=wait_time, expiration=expiration)
+        # expire around when history says the line should have dropped, instead of a flat 2 hours
+        estimate = await asyncio.to_thread(forecast.estimate, ride.id, wait_time, park.timezone, now=int(time.time()))
+
+        if nlp.detect_update_message(analysis):
+            reply = await logic.alert_update_flow(ride=ride, phone_number=phone_number, wait_time=wait_time, expiration=estimate.expiration)
+
+        else:
+            reply = await logic.alert_creation_flow(ride=ride, park=park, phone_number=phone_number, wait_time=wait_time, expiration=estimate.expiration, estimate=estimate)
     
     return reply
\ No newline at end of file
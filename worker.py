@@ -0,0 +1,53 @@
+import datetime
+import logging
+import os
+import time
+from apscheduler.schedulers.blocking import BlockingScheduler
+from apscheduler.triggers.cron import CronTrigger
+from controllers.cronjobs import *
+from utils.postgres import init_db, LeaderLock
+import env
+
+
+logging.basicConfig(level=env.LOG_LEVEL)
+logger = logging.getLogger('uvicorn')
+
+
+SCHEDULER_LOCK_KEY = 0x66697265 # arbitrary, shared by every worker process
+LEADER_RETRY = 30 # seconds between attempts to take over as scheduler
+
+
+# set up background tasks
+scheduler = BlockingScheduler()
+fetch_job = scheduler.add_job(fetch_parks_json, CronTrigger.from_crontab('3 * * * *')) # hourly, off the 5-minute marks
+update_job = scheduler.add_job(update_wait_times, CronTrigger.from_crontab('* * * * *')) # polls only the parks that are due
+close_job = scheduler.add_job(close_out_alerts, CronTrigger.from_crontab('* * * * *'))
+history_job = scheduler.add_job(roll_up_wait_history, CronTrigger.from_crontab('30 9 * * *')) # early morning for US parks
+
+
+def check_leadership(lock:LeaderLock):
+    if not lock.is_held():
+        # another worker may already be taking over - exit rather than risk duplicate jobs, the platform restarts us
+        logger.error('Lost scheduler lock, exiting')
+        os._exit(1)
+
+
+def main():
+    init_db()
+    # only one worker runs the jobs, the rest wait to take over if it dies
+    lock = LeaderLock(SCHEDULER_LOCK_KEY)
+    while not lock.try_acquire():
+        logger.info(f"Another worker holds the scheduler lock, retrying in {LEADER_RETRY} seconds")
+        time.sleep(LEADER_RETRY)
+    logger.info('Acquired scheduler lock, starting jobs')
+    scheduler.add_job(check_leadership, 'interval', seconds=LEADER_RETRY, args=[lock])
+    scheduler.modify_job(fetch_job.id, next_run_time=datetime.datetime.now())
+    scheduler.modify_job(update_job.id, next_run_time=datetime.datetime.now() + datetime.timedelta(seconds=10))
+    try:
+        scheduler.start()
+    finally:
+        lock.release()
+
+
+if __name__ == '__main__':
+    main()